@@ -1,48 +1,170 @@
-from flask import Flask, request, render_template, send_file, flash, redirect, url_for
+from flask import Flask, request, render_template, send_file, flash, redirect, url_for, jsonify, Response, stream_with_context, make_response, g, abort
 import os
+import re
 import json
 import uuid
+import time
+import atexit
+import queue
 import logging
-from model import process_website
+import logging.handlers
+import threading
+import metrics
+from model import process_website, start_preview, PARSER_BACKENDS, LOCALIZE_ASSETS, OPTIMIZE_OUTPUT, CRAWL_SITE, forget_build, logo_store, catalog_store, previews, preview_file
+from catalog import CatalogError
+from jobs import JobQueue, QueueFullError
+from bundle import ZipStream
+from batch import run_batch
+from retention import Retention, locate, shard_path, touch
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging: records are queued and written by a background thread,
+# so request and job threads never block on log I/O
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter(os.environ.get('LOG_FORMAT', '%(asctime)s - %(levelname)s - %(message)s')))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+log_listener.start()
+
+def stop_log_listener():
+    log_listener.stop()
+
+def restart_log_listener():
+    # A forked child (preloaded gunicorn worker, process job pool) has no
+    # writer thread, only a copy of the parent's listener that still looks
+    # started. It gets a new queue and listener of its own, so it neither
+    # replays the parent's pending records nor relies on the copy.
+    global log_queue, log_listener
+    log_queue = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    log_listener.start()
+
+atexit.register(stop_log_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_log_listener)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.path.abspath('uploads')
 app.config['GENERATED_FOLDER'] = os.path.abspath('generated')
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB limit
+# Background generation: POST returns a job id and the work runs on a bounded pool
+app.config['ASYNC_JOBS'] = os.environ.get('ASYNC_JOBS', '1') == '1'
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_LIMIT'] = int(os.environ.get('JOB_QUEUE_LIMIT', 16))
+app.config['JOB_EXECUTOR'] = os.environ.get('JOB_EXECUTOR', 'thread')  # 'thread' or 'process'
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['JOB_POLL_TIMEOUT'] = int(os.environ.get('JOB_POLL_TIMEOUT', 20))  # seconds a long-poll / SSE request may wait
+# Without background jobs, stream the zip to the browser while it is built
+app.config['STREAM_DOWNLOADS'] = os.environ.get('STREAM_DOWNLOADS', '0') == '1'
+# Uploads and generated bundles are deleted once they exceed the quota
+# (least recently downloaded first) or go unused for RETENTION_MAX_AGE
+app.config['RETENTION_MAX_BYTES'] = int(os.environ.get('RETENTION_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['RETENTION_MAX_AGE'] = int(os.environ.get('RETENTION_MAX_AGE', 3 * 86400))
+app.config['RETENTION_INTERVAL'] = int(os.environ.get('RETENTION_INTERVAL', 600))  # 0 disables the sweeper
+app.config['RETENTION_GRACE'] = int(os.environ.get('RETENTION_GRACE', 3600))
+# Let the front proxy send download bodies: 'x-accel' (nginx, served from an
+# internal location mapped to GENERATED_FOLDER) or 'x-sendfile' (Apache, lighttpd)
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD', '').lower()
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/_generated/')
+app.config['USE_X_SENDFILE'] = app.config['DOWNLOAD_OFFLOAD'] == 'x-sendfile'
 
 # Ensure folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['GENERATED_FOLDER'], exist_ok=True)
 
-# Path to JSON file with sections
-JSON_PATH = "about.json"  # Adjust this path as needed
+def forget_removed_bundle(path):
+    # A bundle's build records go with it, however old they are
+    if BUNDLE_NAME.match(os.path.basename(path)):
+        forget_build(path)
 
-def read_json(file_path):
-    logging.debug(f"Reading JSON file: {file_path}")
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            if not content.strip():
-                logging.error(f"JSON file at {file_path} is empty")
-                return None
-            return json.loads(content)
-    except Exception as e:
-        logging.error(f"Failed to read JSON file: {str(e)}")
-        return None
+retention = Retention(
+    [app.config['UPLOAD_FOLDER'], app.config['GENERATED_FOLDER']],
+    max_bytes=app.config['RETENTION_MAX_BYTES'],
+    max_age=app.config['RETENTION_MAX_AGE'],
+    interval=app.config['RETENTION_INTERVAL'],
+    grace=app.config['RETENTION_GRACE'],
+    on_remove=forget_removed_bundle
+)
+if app.config['RETENTION_INTERVAL'] > 0:
+    retention.start()
+
+job_queue = JobQueue(
+    max_workers=app.config['JOB_WORKERS'],
+    max_queue=app.config['JOB_QUEUE_LIMIT'],
+    executor=app.config['JOB_EXECUTOR']
+)
+
+# Only bundles and batch results are served; build records and other side
+# files in the generated folder are not downloads
+DOWNLOAD_NAME = re.compile(r'^(?:website_[0-9a-f]{32}\.zip|batch_[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}\.results\.jsonl)$')
+# Bundles are named by their inputs and never change, so the name is a strong ETag
+BUNDLE_NAME = re.compile(r'^website_([0-9a-f]{32})\.zip$')
+BUNDLE_MAX_AGE = 365 * 86400
+
+@app.context_processor
+def inject_parsers():
+    return {'parsers': PARSER_BACKENDS, 'localize_assets': LOCALIZE_ASSETS, 'optimize_output': OPTIMIZE_OUTPUT, 'crawl_site': CRAWL_SITE}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unknown',
+            status=str(response.status_code)
+        )
+    return response
+
+def with_server_timing(response, timings):
+    # Per-stage generation breakdown, visible in the browser's network panel
+    response = make_response(response)
+    if timings:
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+def generate_website(url, catalog, logo_filename, selected_sections, upload_folder, generated_folder, parser=None, assets=None, optimize=None, crawl=None):
+    output_zip = process_website(
+        url,
+        catalog,
+        os.path.dirname(locate(upload_folder, logo_filename)),
+        [logo_filename],
+        selected_sections,
+        generated_folder,
+        parser,
+        assets=assets,
+        optimize=optimize,
+        crawl=crawl
+    )
+
+    zip_path = shard_path(generated_folder, output_zip)
+    if not os.path.exists(zip_path):
+        raise ValueError("Website generation failed: Output zip file not created")
+
+    logging.debug(f"Generated zip file: {zip_path}")
+    return output_zip
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    # Load sections from JSON
-    sections_data = read_json(JSON_PATH)
-    if not sections_data:
-        flash(f'Failed to read JSON file at {JSON_PATH}.')
+    # Load sections from the cached catalog (optionally a named tenant catalog)
+    catalog_name = request.values.get('catalog') or 'default'
+    try:
+        catalog = catalog_store.get(catalog_name)
+    except CatalogError as e:
+        logging.error(f"Failed to load section catalog: {str(e)}")
+        flash(f'Failed to read section catalog: {str(e)}')
         return render_template('index.html', sections=[])
 
-    sections = list(sections_data.keys())
+    sections = catalog.keys()
     logging.debug(f"Available sections: {sections}")
 
     if request.method == 'POST':
@@ -65,6 +187,21 @@ def index():
             logging.error("No sections selected")
             return render_template('index.html', sections=sections)
 
+        # Optional parser backend override (defaults to the HTML_PARSER setting)
+        parser = request.form.get('parser') or None
+        if parser and parser not in PARSER_BACKENDS:
+            flash(f'Unknown HTML parser: {parser}.')
+            logging.error(f"Invalid parser backend: {parser}")
+            return render_template('index.html', sections=sections)
+
+        # Download stylesheets, scripts, images and fonts into the bundle;
+        # the hidden field makes an unchecked box mean "off" rather than "default"
+        assets = '1' in request.form.getlist('assets')
+        # Minified pages with precompressed .gz/.br siblings
+        optimize = '1' in request.form.getlist('optimize')
+        # Clone the same-origin pages the URL links to as well
+        crawl = '1' in request.form.getlist('crawl')
+
         # Validate logo upload
         logo_file = request.files.get("logo")
         if not logo_file or not logo_file.filename:
@@ -80,37 +217,88 @@ def index():
 
         # Save the logo file
         logo_filename = f"logo_{uuid.uuid4()}{os.path.splitext(logo_file.filename)[1]}"
-        logo_path = os.path.join(app.config['UPLOAD_FOLDER'], logo_filename)
+        logo_path = shard_path(app.config['UPLOAD_FOLDER'], logo_filename)
         try:
+            os.makedirs(os.path.dirname(logo_path), exist_ok=True)
             logo_file.save(logo_path)
             if not (os.path.exists(logo_path) and os.path.getsize(logo_path) > 0):
                 logging.error(f"Failed to save logo or file is empty: {logo_path}")
                 flash('Failed to save logo file or file is empty.')
                 return render_template('index.html', sections=sections)
             logging.debug(f"Uploaded logo: {logo_path}, size: {os.path.getsize(logo_path)} bytes")
+            # Decode and resize in the background while the rest of the request runs
+            logo_store.prefetch(logo_path)
         except Exception as e:
             logging.error(f"Error saving logo file: {str(e)}")
             flash('Error saving logo file.')
             return render_template('index.html', sections=sections)
 
-        # Process website
-        try:
-            logging.debug(f"Processing website with URL: {url}, Logo: {logo_filename}, Sections: {selected_sections}")
-            output_zip = process_website(
-                url,
-                JSON_PATH,
-                app.config['UPLOAD_FOLDER'],
-                [logo_filename],
-                selected_sections,
-                app.config['GENERATED_FOLDER']
-            )
+        logging.debug(f"Processing website with URL: {url}, Logo: {logo_filename}, Sections: {selected_sections}")
 
-            zip_path = os.path.join(app.config['GENERATED_FOLDER'], output_zip)
-            if not os.path.exists(zip_path):
-                raise ValueError("Website generation failed: Output zip file not created")
+        if request.form.get('action') == 'preview':
+            return redirect(url_for(
+                'preview',
+                url=url,
+                catalog=catalog_name,
+                sections=selected_sections,
+                logo=logo_filename,
+                parser=parser or '',
+                assets='1' if assets else '0',
+                optimize='1' if optimize else '0',
+                crawl='1' if crawl else '0'
+            ))
 
-            logging.debug(f"Generated zip file: {zip_path}")
-            return render_template('result.html', zip_file=output_zip)
+        if app.config['ASYNC_JOBS']:
+            try:
+                job_id = job_queue.submit(
+                    generate_website,
+                    url,
+                    catalog,
+                    logo_filename,
+                    selected_sections,
+                    app.config['UPLOAD_FOLDER'],
+                    app.config['GENERATED_FOLDER'],
+                    parser,
+                    assets,
+                    optimize,
+                    crawl
+                )
+            except QueueFullError as e:
+                logging.error(str(e))
+                flash(str(e))
+                return render_template('index.html', sections=sections), 503
+            logging.debug(f"Queued job {job_id}")
+            return redirect(url_for('job_status', job_id=job_id))
+
+        if app.config['STREAM_DOWNLOADS']:
+            return redirect(url_for(
+                'stream_download',
+                url=url,
+                catalog=catalog_name,
+                sections=selected_sections,
+                logo=logo_filename,
+                parser=parser or '',
+                assets='1' if assets else '0',
+                optimize='1' if optimize else '0',
+                crawl='1' if crawl else '0'
+            ))
+
+        # Process website
+        try:
+            with metrics.trace() as timings:
+                output_zip = generate_website(
+                    url,
+                    catalog,
+                    logo_filename,
+                    selected_sections,
+                    app.config['UPLOAD_FOLDER'],
+                    app.config['GENERATED_FOLDER'],
+                    parser,
+                    assets,
+                    optimize,
+                    crawl
+                )
+            return with_server_timing(render_template('result.html', zip_file=output_zip), timings)
 
         except Exception as e:
             logging.error(f"Error processing website: {str(e)}", exc_info=True)
@@ -119,15 +307,307 @@ def index():
 
     return render_template('index.html', sections=sections)
 
+def find_download(filename):
+    # One stat per candidate: the sharded path, then the pre-sharding one
+    root = app.config['GENERATED_FOLDER']
+    for path in (shard_path(root, filename), os.path.join(root, filename)):
+        try:
+            return path, os.stat(path)
+        except OSError:
+            continue
+    return None, None
+
+def bundle_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = BUNDLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/download/<filename>')
 def download_file(filename):
-    file_path = os.path.join(app.config['GENERATED_FOLDER'], filename)
-    if os.path.exists(file_path):
-        logging.debug(f"Sending file: {file_path}")
-        return send_file(file_path, as_attachment=True)
-    logging.error(f"File not found: {file_path}")
-    flash('File not found.')
-    return redirect(url_for('index'))
+    if not DOWNLOAD_NAME.match(filename):
+        abort(404)
+    bundle = BUNDLE_NAME.match(filename)
+    etag = bundle.group(1) if bundle else None
+    # Revalidation of an immutable bundle needs no disk access at all
+    if etag and request.if_none_match.contains(etag):
+        return bundle_cache_headers(Response(status=304), etag)
+
+    file_path, stat = find_download(filename)
+    if file_path is None:
+        logging.error(f"File not found: {filename}")
+        flash('File not found.')
+        return redirect(url_for('index'))
+    logging.debug(f"Sending file: {file_path}")
+    touch(file_path)
+
+    if app.config['DOWNLOAD_OFFLOAD'] == 'x-accel':
+        # nginx serves the body (including Range requests) from its internal location
+        relative = os.path.relpath(file_path, app.config['GENERATED_FOLDER']).replace(os.sep, '/')
+        response = Response(mimetype='application/zip' if bundle else 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + relative
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+        response.last_modified = stat.st_mtime
+        return bundle_cache_headers(response, etag) if etag else response
+
+    # send_file answers If-None-Match / If-Range and Range itself, and sets
+    # X-Sendfile instead of streaming when USE_X_SENDFILE is on
+    response = send_file(file_path, as_attachment=True, etag=etag or True, max_age=BUNDLE_MAX_AGE if etag else None)
+    if etag:
+        response.cache_control.immutable = True
+    return response
+
+def page_query():
+    # The url, catalog, sections, logo and parser query arguments that
+    # /download/stream and /preview share; ValueError carries the message
+    url = request.args.get('url', '')
+    selected_sections = request.args.getlist('sections')
+    logo_filename = request.args.get('logo', '')
+    parser = request.args.get('parser') or None
+    try:
+        catalog = catalog_store.get(request.args.get('catalog') or 'default')
+    except CatalogError as e:
+        raise ValueError(f'Failed to read section catalog: {str(e)}')
+    logo_path = locate(app.config['UPLOAD_FOLDER'], logo_filename)
+    if not url.startswith(('http://', 'https://')) or not selected_sections:
+        raise ValueError('Please provide a valid URL and at least one section.')
+    if os.path.basename(logo_filename) != logo_filename or not os.path.isfile(logo_path):
+        raise ValueError('Logo file not found.')
+    if parser and parser not in PARSER_BACKENDS:
+        raise ValueError(f'Unknown HTML parser: {parser}.')
+    return url, catalog, selected_sections, logo_filename, logo_path, parser
+
+def flag_query():
+    # assets, optimize and crawl: '1' or '0', or None for the deployment default
+    flags = []
+    for name in ('assets', 'optimize', 'crawl'):
+        value = request.args.get(name)
+        flags.append(value == '1' if value else None)
+    return flags
+
+@app.route('/download/stream')
+def stream_download():
+    try:
+        url, catalog, selected_sections, logo_filename, logo_path, parser = page_query()
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('index'))
+    assets, optimize, crawl = flag_query()
+
+    stream = ZipStream()
+
+    def produce():
+        try:
+            process_website(
+                url,
+                catalog,
+                os.path.dirname(logo_path),
+                [logo_filename],
+                selected_sections,
+                app.config['GENERATED_FOLDER'],
+                parser,
+                stream=stream,
+                assets=assets,
+                optimize=optimize,
+                crawl=crawl
+            )
+            stream.finish()
+        except Exception as e:
+            logging.error(f"Error streaming website: {str(e)}", exc_info=True)
+            stream.finish(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    # Fetch/parse errors surface before any zip bytes exist, so they can
+    # still be reported on the form instead of as a truncated download
+    stream.wait_started()
+    if stream.error is not None:
+        flash(f'Error processing website: {str(stream.error)}')
+        return redirect(url_for('index'))
+
+    return Response(
+        stream,
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=website.zip'}
+    )
+
+@app.route('/preview')
+def preview():
+    # Same query as /download/stream. Each change of sections or logo is a
+    # new preview of the same cached page, so only the nav and logo are redone.
+    # The assets, optimize and crawl flags only apply to the export.
+    try:
+        url, catalog, selected_sections, logo_filename, logo_path, parser = page_query()
+        assets, optimize, crawl = flag_query()
+        preview_id = start_preview(url, catalog, selected_sections, logo_filename, os.path.dirname(logo_path), parser, assets, optimize, crawl)
+    except Exception as e:
+        logging.error(f"Error previewing website: {str(e)}")
+        flash(f'Error previewing website: {str(e)}')
+        return redirect(url_for('index'))
+    return redirect(url_for('serve_preview_file', preview_id=preview_id, name='modified_website.html'))
+
+@app.route('/preview/<preview_id>/<path:name>')
+def serve_preview_file(preview_id, name):
+    # Relative links in the preview resolve to the bundle's other files here
+    preview = previews.get(preview_id)
+    if preview is None:
+        flash('Preview expired; please preview the website again.')
+        return redirect(url_for('index'))
+    try:
+        found = preview_file(preview, name)
+    except Exception as e:
+        logging.error(f"Error previewing website: {str(e)}")
+        flash(f'Error previewing website: {str(e)}')
+        return redirect(url_for('index'))
+    if found is None:
+        abort(404)
+    kind, value = found
+    response = send_file(value, max_age=0) if kind == 'file' else Response(value, mimetype='text/html')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/preview/<preview_id>/export', methods=['POST'])
+def export_preview(preview_id):
+    # Builds the bundle from the same inputs, flags included; POST only, so
+    # prefetchers and crawlers following links cannot queue builds
+    preview = previews.get(preview_id)
+    if preview is None:
+        flash('Preview expired; please preview the website again.')
+        return redirect(url_for('index'))
+    args = (
+        preview['url'],
+        preview['catalog'],
+        preview['logo_filename'],
+        preview['selected_keys'],
+        app.config['UPLOAD_FOLDER'],
+        app.config['GENERATED_FOLDER'],
+        preview['parser'],
+        preview['assets'],
+        preview['optimize'],
+        preview['crawl']
+    )
+    if app.config['ASYNC_JOBS']:
+        try:
+            job_id = job_queue.submit(generate_website, *args)
+        except QueueFullError as e:
+            flash(str(e))
+            return redirect(url_for('index'))
+        return redirect(url_for('job_status', job_id=job_id))
+    try:
+        with metrics.trace() as timings:
+            output_zip = generate_website(*args)
+        return with_server_timing(render_template('result.html', zip_file=output_zip), timings)
+    except Exception as e:
+        logging.error(f"Error processing website: {str(e)}", exc_info=True)
+        flash(f'Error processing website: {str(e)}')
+        return redirect(url_for('index'))
+
+def run_uploaded_batch(manifest_path, upload_folder, generated_folder, workers):
+    results_filename = f"batch_{uuid.uuid4()}.results.jsonl"
+    results_path = shard_path(generated_folder, results_filename)
+    os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    run_batch(
+        manifest_path,
+        generated_folder,
+        results_path,
+        image_folder=upload_folder,
+        workers=workers,
+        allow_paths=False
+    )
+    return results_filename
+
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+    # Same manifest format as `python batch.py`; logos must already be uploaded
+    manifest_file = request.files.get('manifest')
+    if not manifest_file or not manifest_file.filename:
+        return jsonify({'error': 'Upload a JSONL or CSV manifest as the "manifest" field'}), 400
+    extension = os.path.splitext(manifest_file.filename)[1].lower()
+    if extension not in ('.jsonl', '.csv'):
+        return jsonify({'error': 'Manifest must be a .jsonl or .csv file'}), 400
+
+    manifest_path = shard_path(app.config['UPLOAD_FOLDER'], f"batch_{uuid.uuid4()}{extension}")
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    manifest_file.save(manifest_path)
+    try:
+        job_id = job_queue.submit(
+            run_uploaded_batch,
+            manifest_path,
+            app.config['UPLOAD_FOLDER'],
+            app.config['GENERATED_FOLDER'],
+            app.config['BATCH_WORKERS']
+        )
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    logging.debug(f"Queued batch job {job_id} for {manifest_path}")
+    return jsonify({'id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+def wants_json():
+    if request.args.get('format') == 'json':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def job_payload(job):
+    payload = {
+        'id': job['id'],
+        'status': job['status'],
+        'error': job['error'],
+        'status_url': url_for('job_status', job_id=job['id'])
+    }
+    if job['status'] == 'done':
+        payload['download_url'] = url_for('download_file', filename=job['result'])
+        payload['timings'] = [{'stage': stage, 'ms': round(seconds * 1000, 1)} for stage, seconds in job['timings']]
+    return payload
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    # ?wait=N long-polls until the job finishes (or N seconds pass)
+    wait = request.args.get('wait', type=float)
+    if wait:
+        job = job_queue.wait(job_id, timeout=min(wait, app.config['JOB_POLL_TIMEOUT']))
+    else:
+        job = job_queue.get(job_id)
+
+    if job is None:
+        if wants_json():
+            return jsonify({'id': job_id, 'status': 'unknown', 'error': 'Job not found'}), 404
+        flash('Job not found.')
+        return redirect(url_for('index'))
+
+    if wants_json():
+        return jsonify(job_payload(job))
+
+    if job['status'] == 'done':
+        if wait:
+            return redirect(url_for('download_file', filename=job['result']))
+        return with_server_timing(render_template('result.html', zip_file=job['result']), job['timings'])
+
+    return render_template('status.html', job=job)
+
+@app.route('/status/<job_id>/events')
+def job_events(job_id):
+    def stream():
+        last_status = None
+        job = job_queue.get(job_id)
+        while True:
+            if job is None:
+                yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f"event: status\ndata: {json.dumps(job_payload(job))}\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+            # Keep-alive comment while the job is still running
+            yield ': waiting\n\n'
+            job = job_queue.wait(job_id, timeout=app.config['JOB_POLL_TIMEOUT'])
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
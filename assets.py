@@ -0,0 +1,334 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; it is imported on the first download
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+ASSET_TAGS = ["base", "link", "img", "source", "script", "video", "style"]
+LINK_RELS = {"stylesheet", "icon", "shortcut", "apple-touch-icon", "preload", "modulepreload"}
+CSS_URL = re.compile(rb"""url\(\s*(["']?)([^"')]+)\1\s*\)|@import\s+(["'])([^"']+)\3""", re.IGNORECASE)
+SAFE_EXTENSION = re.compile(r"^[a-z0-9]{1,8}$")
+CONTENT_TYPE_EXTENSIONS = {
+    "text/css": "css",
+    "text/javascript": "js",
+    "application/javascript": "js",
+    "image/jpeg": "jpg",
+    "image/svg+xml": "svg",
+    "image/x-icon": "ico",
+    "image/vnd.microsoft.icon": "ico",
+    "font/woff2": "woff2",
+    "font/woff": "woff",
+}
+# Nested stylesheets (@import inside @import) are followed this deep
+MAX_CSS_DEPTH = 3
+
+
+def fetchable(url):
+    return urlsplit(url).scheme in ("http", "https")
+
+
+def extension_for(url, content_type):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type)
+    if not extension and content_type:
+        guessed = mimetypes.guess_extension(content_type)
+        extension = guessed.lstrip(".") if guessed else None
+    if not extension:
+        extension = os.path.splitext(urlsplit(url).path)[1].lstrip(".").lower()
+    return extension if extension and SAFE_EXTENSION.match(extension) else "bin"
+
+
+def is_css(record):
+    return record["ext"] == "css"
+
+
+def css_references(data):
+    for match in CSS_URL.finditer(data):
+        ref = (match.group(2) or match.group(4)).strip()
+        yield match, ref.decode("utf-8", "replace")
+
+
+def split_srcset(value):
+    candidates = []
+    for candidate in value.split(","):
+        parts = candidate.strip().split(None, 1)
+        if parts:
+            candidates.append((parts[0], parts[1] if len(parts) > 1 else ""))
+    return candidates
+
+
+class AssetStore:
+    # Downloaded assets shared by every job: bodies are stored once under
+    # their SHA-256, and each URL maps to the body it last returned. Over
+    # max_bytes, the least recently used bodies go, except those used in the
+    # last grace seconds, which a running job may still be copying.
+    def __init__(self, root="cache/assets", ttl=86400, max_bytes=500 * 1024 * 1024, grace=600):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._evict_lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _url_path(self, url):
+        return os.path.join(self.root, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def lookup(self, url):
+        try:
+            with open(self._url_path(url), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - record["fetched_at"] > self.ttl or not self._touch(self.blob_path(record["sha256"])):
+            return None
+        return record
+
+    def put(self, url, data, content_type):
+        digest = hashlib.sha256(data).hexdigest()
+        record = {
+            "url": url,
+            "sha256": digest,
+            "ext": extension_for(url, content_type),
+            "size": len(data),
+            "fetched_at": time.time(),
+        }
+        try:
+            blob = self.blob_path(digest)
+            if not self._touch(blob):
+                self._write(blob, data)
+            self._write(self._url_path(url), json.dumps(record).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Failed to cache asset %s: %s", url, e)
+            return None
+        return record
+
+    def read(self, record):
+        with open(self.blob_path(record["sha256"]), "rb") as f:
+            return f.read()
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _touch(self, path):
+        # Whether the file exists; reads bump its mtime for eviction
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def evict(self):
+        # Least recently used bodies go first; expired URL records are
+        # never read again and go too
+        with self._evict_lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for directory, _, filenames in os.walk(os.path.join(self.root, "blobs")):
+                for name in filenames:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            entries.sort()
+            for used, size, path in entries:
+                if total <= self.max_bytes or now - used < self.grace:
+                    break
+                self._remove(path)
+                total -= size
+            for directory, _, filenames in os.walk(os.path.join(self.root, "urls")):
+                for name in filenames:
+                    path = os.path.join(directory, name)
+                    try:
+                        expired = now - os.stat(path).st_mtime > self.ttl
+                    except OSError:
+                        continue
+                    if expired:
+                        self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class AssetLocalizer:
+    # Downloads the assets one page refers to, concurrently and within a
+    # byte, count and time budget. Whatever does not fit keeps pointing at
+    # the origin.
+    def __init__(self, store, max_bytes=20 * 1024 * 1024, max_file_bytes=5 * 1024 * 1024, max_count=300,
+                 deadline=20, concurrency=16, per_host=4, timeout=10):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_count = max_count
+        self.deadline = deadline
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+
+    def fetch_all(self, urls):
+        # Returns {url: record} for every asset now in the store, following
+        # url()/@import references inside stylesheets
+        import asyncio
+
+        try:
+            return asyncio.run(self._fetch_all(urls))
+        finally:
+            self.store.evict()
+
+    async def _fetch_all(self, urls):
+        import asyncio
+        import httpx
+
+        records = {}
+        budget = {"bytes": self.max_bytes, "count": self.max_count}
+        started = time.monotonic()
+        hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True, limits=limits) as client:
+            wave = list(dict.fromkeys(url for url in urls if fetchable(url)))
+            for _ in range(MAX_CSS_DEPTH + 1):
+                remaining = self.deadline - (time.monotonic() - started)
+                if not wave or remaining <= 0:
+                    break
+                tasks = {
+                    asyncio.ensure_future(self._fetch_one(client, url, hosts[urlsplit(url).netloc], budget)): url
+                    for url in wave
+                }
+                done, pending = await asyncio.wait(tasks, timeout=remaining)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    logger.warning("Asset deadline reached, %d assets left on the origin", len(pending))
+                    await asyncio.gather(*pending, return_exceptions=True)
+                for task in done:
+                    record = task.result()
+                    if record is not None:
+                        records[tasks[task]] = record
+
+                # Stylesheets pull in fonts, images and further stylesheets
+                wave = []
+                for url in tasks.values():
+                    record = records.get(url)
+                    if record is None or not is_css(record):
+                        continue
+                    for _, ref in css_references(self.store.read(record)):
+                        child = urljoin(url, ref)
+                        if fetchable(child) and child not in records and child not in wave:
+                            wave.append(child)
+        return records
+
+    async def _fetch_one(self, client, url, host_limit, budget):
+        import httpx
+
+        record = self.store.lookup(url)
+        if record is not None:
+            metrics.cache_requests.inc(cache="asset", result="hit")
+            return record
+        if budget["count"] <= 0:
+            return None
+        budget["count"] -= 1
+        metrics.cache_requests.inc(cache="asset", result="miss")
+        async with host_limit:
+            try:
+                async with client.stream("GET", url) as response:
+                    if response.status_code != 200:
+                        logger.debug("Asset %s returned HTTP %d", url, response.status_code)
+                        return None
+                    declared = response.headers.get("content-length", "")
+                    if declared.isdigit() and int(declared) > min(self.max_file_bytes, budget["bytes"]):
+                        logger.debug("Asset %s is too large (%s bytes)", url, declared)
+                        return None
+                    chunks = []
+                    size = 0
+                    try:
+                        # Bytes are charged to the shared budget as they
+                        # arrive so parallel downloads cannot overshoot it
+                        async for chunk in response.aiter_bytes():
+                            size += len(chunk)
+                            budget["bytes"] -= len(chunk)
+                            if size > self.max_file_bytes or budget["bytes"] < 0:
+                                logger.debug("Asset %s exceeded the size budget", url)
+                                budget["bytes"] += size
+                                return None
+                            chunks.append(chunk)
+                    except BaseException:
+                        budget["bytes"] += size
+                        raise
+                    metrics.asset_bytes.inc(size)
+                    return self.store.put(url, b"".join(chunks), response.headers.get("content-type"))
+            except (httpx.HTTPError, httpx.InvalidURL, OSError) as e:
+                logger.debug("Asset %s failed: %s", url, e)
+                return None
+
+
+class LocalizedAssets:
+    # The assets one page ended up with, as zip entries under folder/
+    def __init__(self, store, folder="assets"):
+        self.store = store
+        self.folder = folder
+        self.entries = {}
+        self._names = {}
+
+    def name_for(self, url, records, visiting=()):
+        # Stylesheets are rewritten to point at their localized children, so
+        # their entry name is the hash of the rewritten bytes; everything
+        # else is named by its original content hash, deduplicating copies
+        if url in self._names:
+            return self._names[url]
+        record = records.get(url)
+        if record is None or url in visiting:
+            return None
+        if not is_css(record):
+            name = f"{record['sha256'][:16]}.{record['ext']}"
+            self.entries.setdefault(name, ("file", self.store.blob_path(record["sha256"])))
+        else:
+            data = self.rewrite_css(self.store.read(record), url, records, "", visiting + (url,))
+            name = f"{hashlib.sha256(data).hexdigest()[:16]}.css"
+            self.entries.setdefault(name, ("bytes", data))
+        self._names[url] = name
+        return name
+
+    def rewrite_css(self, data, base_url, records, prefix="", visiting=()):
+        # prefix is the path from the referring file to the asset folder
+        def replace(match):
+            ref = (match.group(2) or match.group(4)).decode("utf-8", "replace").strip()
+            url = urljoin(base_url, ref)
+            name = self.name_for(url, records, visiting)
+            if name is not None:
+                target = f"{prefix}{name}"
+            elif fetchable(url):
+                # Not downloaded: keep loading it from the origin
+                target = url
+            else:
+                return match.group(0)
+            if match.group(4) is not None:
+                return f'@import "{target}"'.encode("utf-8")
+            return f'url("{target}")'.encode("utf-8")
+        return CSS_URL.sub(replace, data)
+
+    def path_for(self, url, records):
+        name = self.name_for(url, records)
+        return f"{self.folder}/{name}" if name else None
@@ -0,0 +1,201 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import model
+from retention import locate
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path):
+    jobs = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                jobs.append(dict(row))
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    job = {"error": f"Line {line_number} is not valid JSON: {e}"}
+                if not isinstance(job, dict):
+                    job = {"error": f"Line {line_number} is not a JSON object"}
+                jobs.append(job)
+    for number, job in enumerate(jobs, 1):
+        job.setdefault("id", str(number))
+        sections = job.get("sections") or []
+        if isinstance(sections, str):
+            sections = [s.strip() for s in sections.replace(";", "|").split("|") if s.strip()]
+        job["sections"] = sections
+        # Blank means "use the LOCALIZE_ASSETS / OPTIMIZE_OUTPUT / CRAWL_SITE default"
+        for flag in ("assets", "optimize", "crawl"):
+            value = job.get(flag)
+            if isinstance(value, str):
+                value = value.strip().lower() in ("1", "true", "yes") if value.strip() else None
+            job[flag] = value
+    return jobs
+
+
+def validate_job(job, allow_paths=True):
+    if job.get("error"):
+        return job["error"]
+    url = job.get("url")
+    if not isinstance(url, str) or not url.strip():
+        return "Missing url"
+    if not allow_paths and not url.startswith(("http://", "https://")):
+        return "url must start with http:// or https://"
+    sections = job["sections"]
+    if not isinstance(sections, list) or not all(isinstance(section, str) for section in sections):
+        return "sections must be a list of section names"
+    if not sections:
+        return "No sections given"
+    logo = job.get("logo")
+    if logo is not None and not isinstance(logo, str):
+        return "logo must be a file name"
+    if logo and not allow_paths and os.path.basename(logo) != logo:
+        return "logo must be a file name in the upload folder"
+    catalog = job.get("catalog")
+    if catalog is not None and not isinstance(catalog, str):
+        return "catalog must be a catalog name"
+    if catalog and not allow_paths and catalog.endswith(".json"):
+        return "catalog must be a catalog name"
+    return None
+
+
+def resolve_catalog(name):
+    # Paths are registered under their own name so every job in this
+    # process shares the parsed copy
+    if not name:
+        return model.catalog_store.get()
+    if name.endswith(".json"):
+        model.catalog_store.register(name, name)
+    return model.catalog_store.get(name)
+
+
+def logo_path(job, image_folder):
+    logo = job.get("logo")
+    if not logo:
+        return None
+    return logo if os.path.dirname(logo) else locate(image_folder, logo)
+
+
+def run_job(job, output_folder, image_folder):
+    started = time.perf_counter()
+    result = {"id": job["id"], "url": job.get("url"), "sections": job["sections"], "zip": None, "error": None}
+    try:
+        catalog = resolve_catalog(job.get("catalog"))
+        logo = logo_path(job, image_folder)
+        result["zip"] = model.process_website(
+            job["url"],
+            catalog,
+            os.path.dirname(logo) if logo else image_folder,
+            [os.path.basename(logo)] if logo else [],
+            job["sections"],
+            output_folder,
+            job.get("parser") or None,
+            assets=job["assets"],
+            optimize=job["optimize"],
+            crawl=job["crawl"]
+        )
+        result["status"] = "done"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e) or e.__class__.__name__
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def warm_caches(jobs, image_folder, workers):
+    # Fetch each distinct URL and derive each distinct logo once up front so
+    # the generation workers only hit the shared on-disk caches
+    urls = sorted({job["url"] for job in jobs if job["url"].startswith("http")})
+    logos = sorted({logo_path(job, image_folder) for job in jobs if job.get("logo")})
+
+    def warm(task):
+        kind, value = task
+        try:
+            if kind == "url":
+                model.fetch_html(value)
+            else:
+                model.logo_store.derive(value)
+        except Exception as e:
+            logger.warning("Warm-up failed for %s: %s", value, e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(warm, [("url", url) for url in urls] + [("logo", logo) for logo in logos]))
+
+
+def run_batch(manifest_path, output_folder, results_path, image_folder="uploads", workers=None, allow_paths=True):
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_folder, exist_ok=True)
+    jobs = read_manifest(manifest_path)
+    started = time.perf_counter()
+
+    results = []
+    runnable = []
+    for job in jobs:
+        error = validate_job(job, allow_paths)
+        if error:
+            results.append({"id": job["id"], "url": job.get("url"), "sections": job["sections"],
+                            "zip": None, "status": "failed", "error": error, "seconds": 0})
+        else:
+            runnable.append(job)
+
+    warm_caches(runnable, image_folder, workers)
+
+    with open(results_path, "w", encoding="utf-8") as out:
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+        if multiprocessing.current_process().daemon or workers == 1:
+            # Daemonic pool workers cannot start their own pool
+            for job in runnable:
+                result = run_job(job, output_folder, image_folder)
+                results.append(result)
+                out.write(json.dumps(result) + "\n")
+        else:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [executor.submit(run_job, job, output_folder, image_folder) for job in runnable]
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for result in results if result["status"] == "failed")
+    logger.info("Batch finished: %d jobs, %d failed, %.1fs (%.1f jobs/s)",
+                len(results), failed, elapsed, len(results) / elapsed if elapsed else 0)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate many websites from a JSONL or CSV manifest.")
+    parser.add_argument("manifest", help="JSONL or CSV file with url, sections, logo, catalog, parser, assets, optimize, crawl columns")
+    parser.add_argument("--output", default="generated", help="Folder for generated zip files")
+    parser.add_argument("--results", default=None, help="Results manifest path (default: <manifest>.results.jsonl)")
+    parser.add_argument("--images", default="uploads", help="Folder for logo file names without a directory")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    # Per-job progress is logged at DEBUG/INFO; raise LOG_LEVEL to see it
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper(), format="%(message)s")
+    logger.setLevel(logging.INFO)
+
+    results_path = args.results or f"{os.path.splitext(args.manifest)[0]}.results.jsonl"
+    results = run_batch(args.manifest, args.output, results_path, args.images, args.workers)
+    print(f"Results written to {results_path}")
+    return 1 if any(result["status"] == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
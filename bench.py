@@ -0,0 +1,366 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import model
+from bundle import BundleWriter
+from catalog import load_catalog
+from html_cache import HTMLCache
+from logo_store import LogoStore
+from page_cache import PageCache
+from preview import PreviewCache
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "about.json")
+STAGES = ["fetch", "parse", "nav", "logo", "links_forms", "serialize", "sections", "zip", "total"]
+SYNTHETIC_PROFILES = {
+    "synthetic_small": {"paragraphs": 50, "depth": 8, "anchors": 50, "forms": 2},
+    "synthetic_large": {"paragraphs": 2000, "depth": 40, "anchors": 2000, "forms": 50},
+}
+# Stages faster than this are too noisy to flag as regressions
+MIN_SECONDS = 0.002
+MIN_ALLOC_KB = 64
+
+
+def synthetic_page(paragraphs=100, depth=10, anchors=100, forms=5, seed=0):
+    rng = random.Random(seed)
+    words = ["catalog", "shipping", "offer", "product", "support", "account", "store", "order"]
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(6, 18)))
+
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Synthetic store</title></head><body>",
+        "<header><h1>Synthetic store</h1><img src=\"/static/logo.png\" alt=\"logo\" width=\"120\"></header>",
+        "<nav><a href=\"/search\">Search</a> <a href=\"/images\">Images</a> <a href=\"/news\">News</a></nav>",
+    ]
+    parts.append("<div class=\"level\">" * depth)
+    for _ in range(paragraphs):
+        parts.append(f"<p>{sentence()}</p>")
+    parts.append("</div>" * depth)
+    parts.append("<ul>")
+    for i in range(anchors):
+        parts.append(f"<li><a href=\"/product/{i}\">{sentence()}</a></li>")
+    parts.append("</ul>")
+    for i in range(forms):
+        parts.append(
+            f"<form action=\"/subscribe/{i}\" method=\"post\"><input type=\"email\" name=\"email\">"
+            f"<input type=\"submit\" value=\"Go\"><button type=\"submit\">Send</button></form>"
+        )
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def parse_profile(text):
+    profile = dict(SYNTHETIC_PROFILES["synthetic_small"])
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() not in profile:
+            raise ValueError(f"Unknown synthetic page setting '{name.strip()}'")
+        profile[name.strip()] = int(value)
+    return profile
+
+
+def load_pages(names=None, synthetic=()):
+    pages = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), "rb") as f:
+                pages[os.path.splitext(name)[0]] = f.read()
+    for name, profile in SYNTHETIC_PROFILES.items():
+        pages[name] = synthetic_page(**profile).encode("utf-8")
+    if names:
+        missing = [name for name in names if name not in pages]
+        if missing:
+            raise ValueError(f"Unknown pages: {', '.join(missing)}")
+        pages = {name: pages[name] for name in names}
+    for i, text in enumerate(synthetic):
+        profile = parse_profile(text)
+        label = "synthetic_" + "_".join(f"{key[0]}{value}" for key, value in profile.items())
+        pages[label] = synthetic_page(**profile, seed=i).encode("utf-8")
+    return pages
+
+
+class PageServer:
+    # Local stand-in for the source sites so fetch_html runs over real HTTP
+    def __init__(self, pages):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path.strip("/").removesuffix(".html"))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self._server.server_port}/{name}.html"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the high-water mark, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class RSSSampler:
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = current_rss_kb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_kb())
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_kb())
+        return False
+
+
+class EntryCollector:
+    # Stands in for a BundleWriter so page rendering is timed apart from zipping
+    def __init__(self):
+        self.entries = []
+
+    def add_bytes(self, arcname, data):
+        self.entries.append((arcname, data))
+
+    def add_text(self, arcname, text):
+        self.add_bytes(arcname, text.encode("utf-8"))
+
+
+def isolate_caches(work_dir):
+    # Every iteration starts cold: nothing fetched, derived or rendered yet
+    model.html_cache = HTMLCache(os.path.join(work_dir, "html"), ttl=0, session=model.http_session)
+    model.logo_store = LogoStore(os.path.join(work_dir, "logos"))
+    model.section_page_cache = PageCache(os.path.join(work_dir, "sections"))
+    model.BUILD_CACHE_DIR = os.path.join(work_dir, "builds")
+    model.page_skeletons = PreviewCache("skeleton", model.page_skeletons.max_entries, model.page_skeletons.ttl)
+
+
+def run_stages(url, catalog, sections, image_folder, logo_filename, parser, work_dir, measure):
+    isolate_caches(os.path.join(work_dir, "stages"))
+    with measure("fetch"):
+        html = model.fetch_html(url)
+    with measure("parse"):
+        soup = model.parse_html(html, parser)
+    with measure("nav"):
+        model.TransformPipeline(model.website_rules(sections, logo_filename, image_folder)[:1]).run(soup)
+    with measure("logo"):
+        logo_set = model.derive_logo(logo_filename, image_folder)
+        model.TransformPipeline(model.website_rules(sections, logo_filename, image_folder, logo_set)[1:2]).run(soup)
+    with measure("links_forms"):
+        model.TransformPipeline(model.rewrite_rules()).run(soup)
+    with measure("serialize"):
+        page = str(soup)
+    with measure("sections"):
+        pages = EntryCollector()
+        model.write_static_pages(sections, catalog, "sections", parser, pages)
+        model.create_construction_and_submit_pages("", pages)
+    with measure("zip"):
+        with BundleWriter(os.path.join(work_dir, "stages", "website.zip")) as bundle:
+            for logo_file in (logo_set or {}).get("files", []):
+                bundle.add_file(f"images/{logo_file['name']}", model.logo_store.file_path(logo_set, logo_file["name"]))
+            bundle.add_text("modified_website.html", page)
+            for arcname, data in pages.entries:
+                bundle.add_bytes(arcname, data)
+
+    # The real path fuses the rewrites into one traversal, so it is timed
+    # separately rather than summed from the stages above
+    isolate_caches(os.path.join(work_dir, "total"))
+    with measure("total"):
+        model.process_website(url, catalog, image_folder, [logo_filename], sections,
+                              os.path.join(work_dir, "total"), parser)
+
+
+def time_page(url, catalog, sections, image_folder, logo_filename, parser, repeat):
+    samples = {stage: [] for stage in STAGES}
+
+    @contextlib.contextmanager
+    def measure(stage):
+        started = time.perf_counter()
+        yield
+        samples[stage].append(time.perf_counter() - started)
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            run_stages(url, catalog, sections, image_folder, logo_filename, parser, work_dir, measure)
+    return {
+        stage: {
+            "seconds": round(statistics.median(values), 6),
+            "min_seconds": round(min(values), 6),
+        }
+        for stage, values in samples.items()
+    }
+
+
+def profile_page(url, catalog, sections, image_folder, logo_filename, parser):
+    # Separate pass: tracemalloc slows everything down, so no timings here
+    stats = {}
+
+    @contextlib.contextmanager
+    def measure(stage):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        with RSSSampler() as rss:
+            yield
+        current, peak = tracemalloc.get_traced_memory()
+        stats[stage] = {
+            "peak_rss_kb": rss.peak,
+            "alloc_peak_kb": round((peak - before) / 1024, 1),
+            "alloc_retained_kb": round((current - before) / 1024, 1),
+        }
+
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            run_stages(url, catalog, sections, image_folder, logo_filename, parser, work_dir, measure)
+    finally:
+        tracemalloc.stop()
+    return stats
+
+
+def run_benchmarks(pages, repeat=5, parser=None, sections=None, low_memory=False):
+    catalog = load_catalog(CATALOG_PATH)
+    sections = sections or catalog.keys()[:3]
+    saved = (model.html_cache, model.logo_store, model.section_page_cache, model.LOW_MEMORY_THRESHOLD)
+    if low_memory:
+        model.LOW_MEMORY_THRESHOLD = 1
+    results = {}
+    with tempfile.TemporaryDirectory() as image_folder, PageServer(pages) as server:
+        Image.new("RGB", (600, 240), "purple").save(os.path.join(image_folder, "logo.png"))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for name in pages:
+                    url = server.url(name)
+                    timings = time_page(url, catalog, sections, image_folder, "logo.png", parser, repeat)
+                    memory = profile_page(url, catalog, sections, image_folder, "logo.png", parser)
+                    results[name] = {
+                        "bytes": len(pages[name]),
+                        "stages": {stage: {**timings[stage], **memory[stage]} for stage in STAGES},
+                    }
+                    sys.stderr.write(f"{name}: {timings['total']['seconds'] * 1000:.1f} ms\n")
+        finally:
+            model.html_cache, model.logo_store, model.section_page_cache, model.LOW_MEMORY_THRESHOLD = saved
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parser": parser or model.DEFAULT_PARSER,
+            "repeat": repeat,
+            "low_memory": low_memory,
+            "sections": sections,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "pages": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    for name, page in current["pages"].items():
+        base_page = baseline.get("pages", {}).get(name)
+        if not base_page:
+            continue
+        for stage, values in page["stages"].items():
+            base = base_page["stages"].get(stage)
+            if not base:
+                continue
+            for metric, floor in (("seconds", MIN_SECONDS), ("alloc_peak_kb", MIN_ALLOC_KB)):
+                new, old = values.get(metric), base.get(metric)
+                if new is None or old is None or new - old < floor:
+                    continue
+                if new > old * (1 + threshold):
+                    regressions.append((name, stage, metric, old, new))
+    return regressions
+
+
+def print_report(results):
+    print(f"{'page':<22}{'stage':<13}{'median ms':>10}{'min ms':>9}{'rss MB':>9}{'alloc KB':>10}")
+    for name, page in results["pages"].items():
+        for stage, values in page["stages"].items():
+            print(f"{name:<22}{stage:<13}{values['seconds'] * 1000:>10.2f}{values['min_seconds'] * 1000:>9.2f}"
+                  f"{values['peak_rss_kb'] / 1024:>9.1f}{values['alloc_peak_kb']:>10.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark process_website stage by stage.")
+    parser.add_argument("--pages", nargs="*", help="Page names to run (default: corpus and built-in synthetic pages)")
+    parser.add_argument("--synthetic", action="append", default=[],
+                        help="Extra synthetic page, e.g. paragraphs=5000,depth=100,anchors=3000,forms=20")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed iterations per page")
+    parser.add_argument("--parser", choices=model.PARSER_BACKENDS, default=None, help="HTML parser backend")
+    parser.add_argument("--low-memory", action="store_true", help="Run the total stage in low-memory (streaming) mode")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Allowed slowdown or allocation growth as a fraction (default: 0.15)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(load_pages(args.pages, args.synthetic), args.repeat, args.parser, low_memory=args.low_memory)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, stage, metric, old, new in regressions:
+            print(f"REGRESSION {name} {stage} {metric}: {old} -> {new} (+{(new / old - 1) * 100 if old else 0:.0f}%)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
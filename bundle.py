@@ -0,0 +1,253 @@
+import contextlib
+import os
+import queue
+import shutil
+import struct
+import threading
+import uuid
+import zipfile
+
+# Already-compressed formats gain nothing from DEFLATE, so they are STORED
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif",
+    ".zip", ".gz", ".br", ".woff", ".woff2", ".mp4", ".webm",
+}
+
+
+# Fixed entry metadata so identical inputs produce byte-identical archives
+ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ENTRY_MODE = 0o644
+
+
+def compression_for(arcname):
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def entry_info(arcname):
+    info = zipfile.ZipInfo(arcname, date_time=ENTRY_DATE_TIME)
+    info.compress_type = compression_for(arcname)
+    info.create_system = 3
+    info.external_attr = ENTRY_MODE << 16
+    return info
+
+
+class PreviousBundle:
+    # An earlier archive and its artifact manifest ({group: {"hash",
+    # "entries"}}), used as the source for artifacts whose inputs are unchanged
+    def __init__(self, path, artifacts):
+        self.path = path
+        self.artifacts = artifacts
+        self._zip = zipfile.ZipFile(path, "r")
+
+    def matches(self, group, digest):
+        artifact = self.artifacts.get(group)
+        return artifact is not None and artifact["hash"] == digest
+
+    def entries(self, group):
+        return [self._zip.getinfo(name) for name in self.artifacts[group]["entries"]]
+
+    def read(self, info):
+        return self._zip.read(info)
+
+    def copy_raw(self, info, dst):
+        # Compressed bytes straight from the local file header onwards
+        fp = self._zip.fp
+        fp.seek(info.header_offset)
+        header = fp.read(30)
+        if header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename} in {self.path}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        fp.seek(info.header_offset + 30 + name_length + extra_length)
+        remaining = info.compress_size
+        while remaining:
+            chunk = fp.read(min(remaining, 64 * 1024))
+            if not chunk:
+                raise zipfile.BadZipFile(f"{info.filename} is truncated in {self.path}")
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        self._zip.close()
+
+
+class BundleWriter:
+    # Writes artifacts straight into the output zip. A file target is built
+    # under a hidden, per-writer .part name and only renamed into place on
+    # success, so concurrent builds of the same bundle never share a file.
+    # An optimizer (optimize.OutputOptimizer) may rewrite entries and add
+    # siblings as they are written. With a previous bundle, artifacts whose
+    # input hash is unchanged are copied from it without recompression.
+    def __init__(self, path=None, fileobj=None, optimizer=None, previous=None):
+        if path is None and fileobj is None:
+            raise ValueError("BundleWriter needs a path or a file object")
+        self.path = path
+        self._part_path = None
+        if fileobj is None:
+            directory, name = os.path.split(path)
+            self._part_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.part")
+            fileobj = self._part_path
+        self._zip = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED)
+        self.optimizer = optimizer
+        self.previous = previous
+        self.entries = []
+        # {group: {"hash", "entries"}} in write order, for the build manifest
+        self.artifacts = {}
+        self.reused = []
+        self._group = None
+
+    def can_reuse(self, group, digest):
+        return self.previous is not None and self.previous.matches(group, digest)
+
+    def artifact(self, group, digest):
+        # Starts a named group of entries built from inputs hashing to
+        # digest. Returns True when the group was copied from the previous
+        # bundle, in which case the caller skips building it.
+        self._group = self.artifacts[group] = {"hash": digest, "entries": []}
+        if not self.can_reuse(group, digest):
+            return False
+        for info in self.previous.entries(group):
+            self._copy_entry(info)
+        self.reused.append(group)
+        return True
+
+    def _copy_entry(self, info):
+        target = entry_info(info.filename)
+        if target.compress_type != info.compress_type:
+            self.add_bytes(info.filename, self.previous.read(info))
+            return
+        target.CRC = info.CRC
+        target.compress_size = info.compress_size
+        target.file_size = info.file_size
+        # Mirrors ZipFile._open_to_write, with the data already compressed;
+        # the local header matches what writestr produces for the same entry
+        archive = self._zip
+        if archive._seekable:
+            archive.fp.seek(archive.start_dir)
+        target.header_offset = archive.fp.tell()
+        archive._writecheck(target)
+        archive._didModify = True
+        archive.fp.write(target.FileHeader(False))
+        self.previous.copy_raw(info, archive.fp)
+        archive.start_dir = archive.fp.tell()
+        archive.filelist.append(target)
+        archive.NameToInfo[target.filename] = target
+        self._record(target.filename)
+
+    def _record(self, arcname):
+        self.entries.append(arcname)
+        if self._group is not None:
+            self._group["entries"].append(arcname)
+
+    def add_bytes(self, arcname, data):
+        if self.optimizer is not None and self.optimizer.handles(arcname):
+            entries = self.optimizer.process(arcname, data)
+        else:
+            entries = [(arcname, data)]
+        for name, payload in entries:
+            self._zip.writestr(entry_info(name), payload)
+            self._record(name)
+
+    def add_text(self, arcname, text):
+        self.add_bytes(arcname, text.encode("utf-8"))
+
+    @contextlib.contextmanager
+    def open_text(self, arcname):
+        # Yields a write(text) callable that streams into the entry; pages
+        # the optimizer rewrites are collected and added whole
+        if self.optimizer is not None and self.optimizer.handles(arcname):
+            parts = []
+            yield parts.append
+            self.add_text(arcname, "".join(parts))
+            return
+        with self._zip.open(entry_info(arcname), "w") as dst:
+            yield lambda text: dst.write(text.encode("utf-8"))
+        self._record(arcname)
+
+    def add_file(self, arcname, file_path):
+        if self.optimizer is not None and self.optimizer.handles(arcname):
+            with open(file_path, "rb") as f:
+                self.add_bytes(arcname, f.read())
+            return
+        with open(file_path, "rb") as src, self._zip.open(entry_info(arcname), "w") as dst:
+            shutil.copyfileobj(src, dst, 64 * 1024)
+        self._record(arcname)
+
+    def close(self):
+        self._zip.close()
+        if self.previous is not None:
+            self.previous.close()
+        if self._part_path:
+            os.replace(self._part_path, self.path)
+
+    def abort(self):
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+        if self.previous is not None:
+            self.previous.close()
+        if self._part_path and os.path.exists(self._part_path):
+            os.remove(self._part_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class ZipStream:
+    # Unseekable file object that hands zip bytes to an HTTP response as they
+    # are written. The producer blocks when the reader falls behind and fails
+    # fast once the reader goes away.
+    def __init__(self, max_chunks=64):
+        self._queue = queue.Queue(max_chunks)
+        self._started = threading.Event()
+        self._aborted = False
+        self.error = None
+
+    def write(self, data):
+        if data:
+            self._started.set()
+            self._put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self, error=None):
+        self.error = error
+        self._started.set()
+        try:
+            self._put(None)
+        except OSError:
+            pass
+
+    def wait_started(self, timeout=None):
+        return self._started.wait(timeout)
+
+    def _put(self, item):
+        while True:
+            if self._aborted:
+                raise OSError("Download stream closed by client")
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._aborted = True
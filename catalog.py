@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+CATALOG_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class SectionCatalog:
+    def __init__(self, name, path, sections, version):
+        self.name = name
+        self.path = path
+        self.sections = sections
+        self.version = version
+
+    def keys(self):
+        return list(self.sections.keys())
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __contains__(self, key):
+        return key in self.sections
+
+    def __getitem__(self, key):
+        return self.sections[key]
+
+
+def parse_catalog(name, path, raw):
+    if not raw.strip():
+        raise CatalogError(f"JSON file at {path} is empty")
+    try:
+        sections = json.loads(raw)
+    except ValueError as e:
+        raise CatalogError(f"JSON file at {path} is not valid JSON: {e}")
+    if not isinstance(sections, dict) or not sections:
+        raise CatalogError(f"JSON file at {path} must be a non-empty object of section names to content")
+    for key, content in sections.items():
+        if not key.strip():
+            raise CatalogError(f"JSON file at {path} has an empty section name")
+        if not isinstance(content, str):
+            raise CatalogError(f"Section '{key}' in {path} must map to a string")
+    version = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return SectionCatalog(name, path, sections, version)
+
+
+def load_catalog(path, name=None):
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_catalog(name or path, path, f.read())
+
+
+class CatalogStore:
+    # Parsed catalogs are kept per name and re-read only when the file's
+    # mtime, inode or size changes; the least recently used name is dropped
+    # once more than max_catalogs are loaded.
+    def __init__(self, default_path, catalog_dir=None, max_catalogs=8):
+        self.default_path = default_path
+        self.catalog_dir = catalog_dir
+        self.max_catalogs = max_catalogs
+        self._paths = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        with self._lock:
+            if self._paths.get(name) != path:
+                self._paths[name] = path
+                self._cache.pop(name, None)
+
+    def path_for(self, name):
+        if name in self._paths:
+            return self._paths[name]
+        if name == "default":
+            return self.default_path
+        if not CATALOG_NAME_PATTERN.match(name) or not self.catalog_dir:
+            raise CatalogError(f"Unknown section catalog '{name}'")
+        return os.path.join(self.catalog_dir, f"{name}.json")
+
+    def get(self, name="default"):
+        path = self.path_for(name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise CatalogError(f"JSON file at {path} does not exist")
+        signature = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and cached[0] == signature:
+                self._cache.move_to_end(name)
+                return cached[1]
+
+        catalog = load_catalog(path, name)
+        with self._lock:
+            self._cache[name] = (signature, catalog)
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.max_catalogs:
+                self._cache.popitem(last=False)
+        return catalog
+
+    def reload(self, name=None):
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(name, None)
@@ -0,0 +1,81 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+from bs4 import BeautifulSoup
+from PIL import Image
+
+from model import PARSER_BACKENDS, parse_html, website_rules, TransformPipeline
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+SECTIONS = ["about us", "faq"]
+
+
+def available_backends():
+    backends = []
+    for backend in PARSER_BACKENDS:
+        try:
+            BeautifulSoup("<p></p>", backend)
+            backends.append(backend)
+        except Exception:
+            print(f"Skipping '{backend}': not installed")
+    return backends
+
+
+def summarize(soup):
+    # What the rewrites decide, independent of how each parser shapes the tree
+    nav_links = [a.get_text() for a in soup.find_all("a", style=True) if "purple" in a["style"]]
+    logos = soup.find_all("img", src=lambda src: src and src.startswith("images/"))
+    anchors = soup.find_all("a", href=True)
+    buttons = soup.find_all("button")
+    inputs = soup.find_all("input")
+    return {
+        "nav": nav_links,
+        "logo": [logo.parent.name for logo in logos],
+        "links": sorted(set(a["href"] for a in anchors)),
+        "link_count": len(anchors),
+        "targets": sum(1 for a in anchors if a.has_attr("target")),
+        "forms": [form.get("action") for form in soup.find_all("form")],
+        "input_formactions": [i.get("formaction") for i in inputs if i.has_attr("formaction")],
+        "button_onclicks": [b.get("onclick") for b in buttons if b.get("type", "").lower() == "submit"],
+    }
+
+
+def run_page(path, backend, image_folder):
+    with open(path, "r", encoding="utf-8") as f:
+        html = f.read()
+    with contextlib.redirect_stdout(io.StringIO()):
+        soup = parse_html(html, backend)
+        soup = TransformPipeline(website_rules(SECTIONS, "logo.png", image_folder)).run(soup)
+    return summarize(soup)
+
+
+def main():
+    backends = available_backends()
+    pages = sorted(name for name in os.listdir(CORPUS_DIR) if name.endswith(".html"))
+    failures = 0
+    with tempfile.TemporaryDirectory() as image_folder:
+        Image.new("RGB", (120, 40), "purple").save(os.path.join(image_folder, "logo.png"))
+        for name in pages:
+            path = os.path.join(CORPUS_DIR, name)
+            reference = run_page(path, backends[0], image_folder)
+            for backend in backends[1:]:
+                result = run_page(path, backend, image_folder)
+                if result != reference:
+                    failures += 1
+                    print(f"MISMATCH {name} [{backend}]")
+                    for key in reference:
+                        if reference[key] != result[key]:
+                            print(f"  {key}: {backends[0]}={reference[key]!r} {backend}={result[key]!r}")
+            print(f"{name}: checked with {', '.join(backends)}")
+    if failures:
+        print(f"{failures} parser mismatches")
+        return 1
+    print("All parser backends agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
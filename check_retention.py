@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from retention import Retention
+
+# Files the app writes, which a sweep past their age must remove
+APP_FILES = [
+    f"logo_{uuid.uuid4()}.png",
+    f"ab/logo_{uuid.uuid4()}.jpg",
+    f"batch_{uuid.uuid4()}.jsonl",
+    f"cd/batch_{uuid.uuid4()}.results.jsonl",
+    f"website_{'e' * 32}.zip",
+    f"ef/website_{'f' * 32}.zip",
+    f"ef/.website_{'f' * 32}.zip.{uuid.uuid4().hex}.part",
+]
+# Files the app did not create, like the sample images shipped in uploads/,
+# which no sweep may touch however old they are
+FOREIGN_FILES = [
+    "logo4.png",
+    "banner10.png",
+    "optimized_logo_3.png",
+    "._logo4.png",
+    ".DS_Store",
+    "notes.txt",
+    "website_latest.zip",
+    f"website_{'e' * 32}.zip.bak",
+    "ab/readme.md",
+    f"archive/website_{'a' * 32}.zip",
+    f"archive/logo_{uuid.uuid4()}.png",
+]
+
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as root:
+        old = time.time() - 30 * 86400
+        for name in APP_FILES + FOREIGN_FILES:
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b"x" * 1024)
+            os.utime(path, (old, old))
+
+        Retention([root], max_bytes=0, max_age=86400, grace=0).sweep()
+
+        for name in APP_FILES:
+            if os.path.exists(os.path.join(root, name)):
+                failures += 1
+                print(f"KEPT {name}: the app created it, the sweep should have removed it")
+        for name in FOREIGN_FILES:
+            if not os.path.exists(os.path.join(root, name)):
+                failures += 1
+                print(f"REMOVED {name}: the app did not create it")
+    if failures:
+        print(f"{failures} retention checks failed")
+        return 1
+    print("Retention only removed files the app created")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Startup budget per entry point in milliseconds, as the median of RUNS
+# fresh interpreters; override with STARTUP_BUDGET_APP_MS etc.
+BUDGETS = {"app": 300, "model": 150}
+RUNS = 5
+# Imported on first use, never by importing the entry points
+LAZY_MODULES = ["asyncio", "bs4", "html5lib", "httpx", "lxml", "PIL", "requests"]
+
+MEASURE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+print((time.perf_counter() - started) * 1000)
+print(" ".join(name for name in {lazy!r} if name in sys.modules))
+"""
+
+
+def run(module, *flags):
+    # No sweeper thread and quiet logs, so only the import itself is timed
+    env = dict(os.environ, RETENTION_INTERVAL="0", LOG_LEVEL="WARNING")
+    code = MEASURE.format(module=module, lazy=LAZY_MODULES)
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def slowest_imports(module, count=10):
+    result = run(module, "-X", "importtime")
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    failures = 0
+    for module, default in BUDGETS.items():
+        budget = float(os.environ.get(f"STARTUP_BUDGET_{module.upper()}_MS", default))
+        times = []
+        for _ in range(RUNS):
+            elapsed, loaded = run(module).stdout.splitlines()[-2:]
+            times.append(float(elapsed))
+        median = statistics.median(times)
+        print(f"import {module}: {median:.0f} ms (budget {budget:.0f} ms)")
+        if loaded:
+            failures += 1
+            print(f"  loaded at import time: {loaded}")
+        if median > budget:
+            failures += 1
+            print("  over budget; slowest imports (cumulative):")
+            for micros, name in slowest_imports(module):
+                print(f"    {micros / 1000:8.1f} ms  {name}")
+    if failures:
+        print(f"{failures} startup checks failed")
+        return 1
+    print("Startup within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
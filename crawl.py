@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+import metrics
+from html_cache import normalize_url
+from stream_rewrite import PageTokenizer, StreamingUnsupported
+
+logger = logging.getLogger(__name__)
+
+START_PAGE = "modified_website.html"
+# Links to these are files, not pages, and are never fetched as HTML
+SKIP_EXTENSIONS = {
+    ".7z", ".avi", ".bmp", ".css", ".csv", ".doc", ".docx", ".dmg", ".eot", ".exe", ".gif", ".gz",
+    ".ico", ".jpeg", ".jpg", ".js", ".json", ".mov", ".mp3", ".mp4", ".ogg", ".otf", ".pdf", ".png",
+    ".ppt", ".pptx", ".rar", ".rss", ".svg", ".tar", ".ttf", ".wav", ".webm", ".webp", ".woff",
+    ".woff2", ".xls", ".xlsx", ".xml", ".zip",
+}
+SKIP_SCHEMES = ("#", "javascript:", "mailto:", "tel:", "data:")
+
+
+def canonical_url(url):
+    return normalize_url(urldefrag(url)[0])
+
+
+def site_of(url):
+    parts = urlsplit(canonical_url(url))
+    return parts.scheme, parts.netloc
+
+
+def in_scope(url, site):
+    if site_of(url) != site:
+        return False
+    path = urlsplit(url).path.lower()
+    return not any(path.endswith(extension) for extension in SKIP_EXTENSIONS)
+
+
+def local_page_name(url):
+    # Flat names next to modified_website.html, so the copies link to each
+    # other and to construction.html without any "../"
+    slug = re.sub(r"[^a-z0-9]+", "-", urlsplit(url).path.lower()).strip("-")
+    slug = re.sub(r"-(html?|php|aspx?)$", "", slug)[:40].strip("-") or "index"
+    return f"page-{slug}-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}.html"
+
+
+class LinkCollector(PageTokenizer):
+    # The same tags the link rule rewrites, plus the first <base href>
+    def __init__(self):
+        super().__init__()
+        self.hrefs = []
+        self.base = None
+
+    def start_tag(self, tag, attrs, position, empty):
+        if tag == "a" and attrs.get("href") is not None:
+            self.hrefs.append(attrs["href"])
+        elif tag == "base" and self.base is None and attrs.get("href"):
+            self.base = attrs["href"]
+
+
+def extract_links(html, base_url):
+    # Canonical absolute URLs of the page's links, in document order. Runs in
+    # the crawl worker processes, so it only takes and returns plain values.
+    collector = LinkCollector()
+    try:
+        collector.run([html])
+    except StreamingUnsupported as e:
+        logger.debug("Could not read links from %s: %s", base_url, e)
+    if collector.base:
+        base_url = urljoin(base_url, collector.base)
+    links = []
+    for href in collector.hrefs:
+        href = href.strip()
+        if href and not href.lower().startswith(SKIP_SCHEMES):
+            links.append(canonical_url(urljoin(base_url, href)))
+    return list(dict.fromkeys(links))
+
+
+class SiteCrawler:
+    # Breadth-first crawl of the same-origin pages a start page links to.
+    # Each depth is fetched concurrently, at most per_host requests to a host
+    # at a time, and pages are taken in the order they were first linked, so
+    # the same site always gives the same pages and names.
+    def __init__(self, fetch, extract=extract_links, max_pages=50, max_depth=2, concurrency=8, per_host=4):
+        self.fetch = fetch
+        self.extract = extract
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.per_host = per_host
+
+    def crawl(self, start_url, start_html=None):
+        # {"pages": [{"url", "name", "depth", "html", "digest"}], "local_pages":
+        # {canonical url: file name}, "failed": count}. Pages with the same
+        # content as an earlier one become aliases of its file.
+        start = canonical_url(start_url)
+        site = site_of(start)
+        hosts = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        hosts_guard = threading.Lock()
+
+        def visit(url, html):
+            if html is None:
+                with hosts_guard:
+                    limit = hosts[urlsplit(url).netloc]
+                with limit:
+                    html = self.fetch(url)
+            return html, self.extract(html, url)
+
+        pages = []
+        local_pages = {}
+        by_digest = {}
+        failed = 0
+        seen = {start}
+        level = [start]
+        depth = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency), thread_name_prefix="crawl") as executor:
+            while level:
+                futures = [executor.submit(visit, url, start_html if url == start else None) for url in level]
+                next_level = []
+                for url, future in zip(level, futures):
+                    try:
+                        html, links = future.result()
+                    except Exception as e:
+                        # Links to it fall back to construction.html
+                        logger.warning("Crawl skipped %s: %s", url, e)
+                        metrics.crawl_pages.inc(result="failed")
+                        failed += 1
+                        continue
+                    digest = hashlib.sha256(html.encode("utf-8", "surrogatepass")).hexdigest()
+                    if digest in by_digest:
+                        local_pages[url] = by_digest[digest]
+                        metrics.crawl_pages.inc(result="duplicate")
+                        continue
+                    name = START_PAGE if url == start else local_page_name(url)
+                    by_digest[digest] = local_pages[url] = name
+                    pages.append({"url": url, "name": name, "depth": depth, "html": html, "digest": digest})
+                    metrics.crawl_pages.inc(result="fetched")
+                    if depth >= self.max_depth:
+                        continue
+                    for link in links:
+                        if link in seen or not in_scope(link, site):
+                            continue
+                        if len(seen) >= self.max_pages:
+                            break
+                        seen.add(link)
+                        next_level.append(link)
+                level = next_level
+                depth += 1
+        return {"pages": pages, "local_pages": local_pages, "failed": failed}
@@ -0,0 +1,21 @@
+import os
+
+# Jobs, previews and their status live in the app process, so one worker
+# serves them all. Status long-polls and event streams each hold a thread
+# while they wait, so the worker runs enough threads for those and the rest
+# of the traffic; the timeout stays above JOB_POLL_TIMEOUT.
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+
+# Import the app once in the master and fork the workers from it. With the
+# warm-up below, parsers, Pillow plugins and the catalog are loaded before
+# the fork, so workers share that memory and serve as soon as they start.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    if preload_app:
+        import model
+        model.warm_up()
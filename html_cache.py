@@ -0,0 +1,329 @@
+import codecs
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+CHUNK_SIZE = 64 * 1024
+# Browsers look for a <meta charset> in the first 1024 bytes
+SNIFF_BYTES = 1024
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9._:-]+)""", re.IGNORECASE)
+BOMS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+
+
+class FetchError(ValueError):
+    pass
+
+
+def valid_encoding(name):
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+
+def sniff_encoding(content_type, head):
+    # BOM, then the Content-Type charset, then <meta charset>, then UTF-8;
+    # only the first bytes are inspected so the body is decoded once
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            encoding = valid_encoding(value.strip().strip("\"'"))
+            if encoding:
+                return encoding
+    match = META_CHARSET.search(head[:SNIFF_BYTES])
+    if match:
+        encoding = valid_encoding(match.group(1).decode("ascii", "replace"))
+        if encoding:
+            return encoding
+    return "utf-8"
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def create_session(pool_connections=10, pool_maxsize=10):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class LazySession:
+    # Stands in for create_session() until the first request, so importing
+    # this module does not import requests
+    def __init__(self, pool_connections=10, pool_maxsize=10):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._session = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = create_session(self.pool_connections, self.pool_maxsize)
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+class HTMLCache:
+    # max_body_bytes and deadline bound a single download: larger or slower
+    # pages are abandoned mid-stream instead of being buffered in full.
+    def __init__(self, cache_dir="cache/html", ttl=300, max_bytes=50 * 1024 * 1024, session=None, timeout=10,
+                 max_body_bytes=10 * 1024 * 1024, deadline=30):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.deadline = deadline
+        self.session = session or LazySession()
+        self._inflight = {}
+        self._inflight_guard = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def fetch(self, url):
+        key = hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+        # Concurrent requests for the same URL share one upstream fetch
+        with self._inflight_guard:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+
+        try:
+            flight["result"] = self._fetch(url, key)
+            return flight["result"]
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._inflight_guard:
+                del self._inflight[key]
+            flight["done"].set()
+
+    def _fetch(self, url, key):
+        meta = self._read_meta(key)
+        body = self._read_body(key) if meta else None
+        if meta and body is not None and time.time() - meta["fetched_at"] < self.ttl:
+            self._touch(key)
+            metrics.cache_requests.inc(cache="html", result="hit")
+            return self._decode(body, meta)
+
+        headers = {}
+        if meta and body is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        # Only encodings _iter_chunks can decode incrementally
+        headers["Accept-Encoding"] = "gzip, deflate"
+        started = time.monotonic()
+        with self.session.get(url, timeout=self._read_timeout(started), headers=headers, stream=True) as response:
+            if response.status_code == 304 and meta and body is not None:
+                meta["fetched_at"] = time.time()
+                self._write_meta(key, meta)
+                metrics.cache_requests.inc(cache="html", result="revalidated")
+                return self._decode(body, meta)
+
+            response.raise_for_status()
+            metrics.cache_requests.inc(cache="html", result="miss")
+            content_type = response.headers.get("content-type", "")
+            if "html" not in content_type.lower():
+                logger.error("URL '%s' does not return HTML content (Content-Type: %s)", url, content_type)
+                raise ValueError("Expected HTML content")
+            declared = response.headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > self.max_body_bytes:
+                raise FetchError(f"Source page is {int(declared)} bytes, over the {self.max_body_bytes} byte limit")
+
+            body, text, encoding = self._read_body_stream(response, content_type, started)
+
+        meta = {
+            "url": normalize_url(url),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "encoding": encoding,
+            "fetched_at": time.time(),
+        }
+        self._store(key, body, meta)
+        return text
+
+    def _read_timeout(self, started):
+        if not self.deadline:
+            return self.timeout
+        return max(0.1, min(self.timeout, self.deadline - (time.monotonic() - started)))
+
+    def _iter_chunks(self, response):
+        # read1 returns whatever has arrived instead of waiting for a full
+        # chunk, so a slow-drip page cannot hold a read open past the
+        # deadline. Decompression happens here in bounded steps so the size
+        # limit applies to the decoded page, not just the compressed bytes.
+        content_encoding = response.headers.get("content-encoding", "").strip().lower()
+        if content_encoding in ("gzip", "x-gzip", "deflate"):
+            # 32 + MAX_WBITS accepts both gzip and zlib headers
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        elif content_encoding in ("", "identity"):
+            decompressor = None
+        else:
+            raise FetchError(f"Unsupported Content-Encoding '{content_encoding}'")
+
+        read = getattr(response.raw, "read1", None) or response.raw.read
+        first = True
+        while True:
+            data = read(CHUNK_SIZE, decode_content=False)
+            if not data:
+                break
+            if decompressor is None:
+                yield data
+                continue
+            if first and content_encoding == "deflate" and data[:1] != b"\x78":
+                # Some servers send raw deflate without the zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            first = False
+            while data:
+                chunk = decompressor.decompress(data, CHUNK_SIZE)
+                data = decompressor.unconsumed_tail
+                if chunk:
+                    yield chunk
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            if chunk:
+                yield chunk
+
+    def _read_body_stream(self, response, content_type, started):
+        # Decode chunk by chunk as it arrives; the raw bytes are kept for the cache
+        chunks = []
+        parts = []
+        size = 0
+        decoder = None
+        encoding = None
+        for chunk in self._iter_chunks(response):
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise FetchError(f"Source page is over the {self.max_body_bytes} byte limit")
+            if self.deadline and time.monotonic() - started > self.deadline:
+                raise FetchError(f"Source page took longer than {self.deadline}s to download")
+            chunks.append(chunk)
+            metrics.fetch_bytes.inc(len(chunk))
+            if decoder is None:
+                if size < SNIFF_BYTES:
+                    continue
+                encoding = sniff_encoding(content_type, b"".join(chunks))
+                decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+                parts.append(decoder.decode(b"".join(chunks)))
+            else:
+                parts.append(decoder.decode(chunk))
+        body = b"".join(chunks)
+        if decoder is None:
+            encoding = sniff_encoding(content_type, body)
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            parts.append(decoder.decode(body))
+        parts.append(decoder.decode(b"", final=True))
+        return body, "".join(parts), encoding
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _decode(self, body, meta):
+        try:
+            return body.decode(meta.get("encoding") or "utf-8", errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
+
+    def _read_meta(self, key):
+        try:
+            with open(self._path(key, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read_body(self, key):
+        try:
+            with open(self._path(key, "html"), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_meta(self, key, meta):
+        tmp_path = self._path(key, f"json.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path(key, "json"))
+
+    def _store(self, key, body, meta):
+        if len(body) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._path(key, f"html.{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(key, "html"))
+            self._write_meta(key, meta)
+            self._evict()
+        except OSError as e:
+            logger.warning("Failed to cache HTML: %s", e)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._path(key, "html"))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Least recently used entries go first; reads bump the body's mtime
+        with self._evict_lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".html"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".html")]))
+                total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, key = entries.pop(0)
+                for ext in ("html", "json"):
+                    try:
+                        os.remove(self._path(key, ext))
+                    except OSError:
+                        pass
+                total -= size
@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import metrics
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def run_traced(fn, args, kwargs):
+    # Module level so it can be pickled for the process executor
+    with metrics.trace() as spans:
+        result = fn(*args, **kwargs)
+    return result, spans
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_queue=16, executor="thread", job_ttl=3600):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_ttl = job_ttl
+        self._in_process = executor != "process"
+        if executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"Job queue is full ({pending} jobs pending). Please try again shortly.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "timings": [],
+                "created": time.time(),
+                "finished": None,
+            }
+            future = self._executor.submit(run_traced, fn, args, kwargs)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._snapshot(job_id)
+
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                job = self._snapshot(job_id)
+                if job is None or job["status"] in ("done", "failed"):
+                    return job
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _snapshot(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        future = self._futures.get(job_id)
+        if job["status"] == "queued" and future is not None and future.running():
+            job["status"] = "running"
+        return dict(job)
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            error = future.exception()
+            if error is not None:
+                job["status"] = "failed"
+                job["error"] = str(error) or error.__class__.__name__
+            else:
+                job["status"] = "done"
+                job["result"], job["timings"] = future.result()
+                if not self._in_process:
+                    # Worker processes have their own registry; fold the
+                    # stage timings into this one for /metrics
+                    for stage, seconds in job["timings"]:
+                        metrics.stage_seconds.observe(seconds, stage=stage)
+            job["finished"] = time.time()
+            self._futures.pop(job_id, None)
+            self._changed.notify_all()
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job["finished"] and job["finished"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,220 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump when the derivative recipe changes so old entries are not reused
+RECIPE_VERSION = 1
+FALLBACK_FORMATS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif"}
+MODERN_FORMATS = ["avif", "webp"]
+SAVE_FORMATS = {"png": "PNG", "jpg": "JPEG", "gif": "GIF", "webp": "WEBP", "avif": "AVIF"}
+# Scale freely, so they are copied unchanged instead of resized
+VECTOR_EXTENSIONS = (".svg", ".svgz")
+
+
+class LogoStore:
+    # Resized logo variants stored under the SHA-256 of the uploaded bytes
+    # plus the transform parameters, so a repeat upload is a directory lookup.
+    # Over max_bytes, the least recently used sets go, except those used in
+    # the last grace seconds, which a running job may still be copying.
+    def __init__(self, root="cache/logos", height=80, scales=(1, 2, 3), quality=85, workers=2,
+                 max_bytes=200 * 1024 * 1024, grace=600):
+        self.root = root
+        self.height = height
+        self.scales = list(scales)
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="logo")
+        self._inflight = {}
+        self._inflight_guard = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    @functools.cached_property
+    def formats(self):
+        # Probing the codecs imports Pillow, so it waits for the first logo
+        from PIL import features
+
+        return [fmt for fmt in MODERN_FORMATS if features.check(fmt)]
+
+    def params(self):
+        return {
+            "version": RECIPE_VERSION,
+            "height": self.height,
+            "scales": self.scales,
+            "quality": self.quality,
+            "formats": self.formats,
+        }
+
+    def key_for(self, data):
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(self.params(), sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def prefetch(self, image_path):
+        # Start decoding in the background, e.g. right after an upload
+        if not self.resizable(image_path):
+            return None
+        future = self._executor.submit(self.derive, image_path)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future):
+        error = future.exception()
+        if error is not None:
+            logger.warning("Background logo decode failed: %s", error, exc_info=error)
+
+    def resizable(self, image_path):
+        return not image_path.lower().endswith(VECTOR_EXTENSIONS)
+
+    def derive(self, image_path):
+        if not self.resizable(image_path):
+            return None
+        with open(image_path, "rb") as f:
+            data = f.read()
+        key = self.key_for(data)
+        manifest = self._read_manifest(key)
+        if manifest is not None:
+            self._touch(key)
+            metrics.cache_requests.inc(cache="logo", result="hit")
+            return manifest
+
+        # Identical uploads being processed concurrently share one build
+        with self._inflight_guard:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        metrics.cache_requests.inc(cache="logo", result="miss" if leader else "coalesced")
+        if not leader:
+            return future.result()
+        try:
+            manifest = self._build(key, image_path)
+            future.set_result(manifest)
+            return manifest
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_guard:
+                self._inflight.pop(key, None)
+
+    def file_path(self, manifest, name):
+        return os.path.join(self.root, manifest["key"], name)
+
+    def _read_manifest(self, key):
+        try:
+            with open(os.path.join(self.root, key, "manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _build(self, key, image_path):
+        from PIL import Image
+
+        manifest = self._read_manifest(key)
+        if manifest is not None:
+            return manifest
+        try:
+            with Image.open(image_path) as img:
+                fallback = FALLBACK_FORMATS.get(img.format, "png")
+                width, height = img.size
+                largest = min(self.height * max(self.scales), height)
+                largest_size = (max(1, round(width * largest / height)), largest)
+                # JPEG can decode straight at a reduced scale
+                img.draft(img.mode, largest_size)
+                img.load()
+                source = img.convert("RGBA") if img.mode in ("P", "1") else img.copy()
+        except Exception as e:
+            logger.warning("Logo derivative build failed: %s", e)
+            return None
+
+        work_dir = os.path.join(self.root, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            files = []
+            seen_heights = set()
+            base_height = min(self.height, height)
+            for scale in self.scales:
+                target_height = min(self.height * scale, height)
+                if target_height in seen_heights:
+                    continue
+                seen_heights.add(target_height)
+                size = (max(1, round(width * target_height / height)), target_height)
+                resized = source.resize(size, Image.Resampling.LANCZOS) if size != source.size else source
+                for fmt in [fallback] + self.formats:
+                    name = f"logo_{key[:16]}_{target_height}.{fmt}"
+                    self._save(resized, fmt, os.path.join(work_dir, name))
+                    files.append({
+                        "name": name,
+                        "format": fmt,
+                        "density": round(target_height / base_height, 2),
+                        "width": size[0],
+                        "height": size[1],
+                    })
+
+            manifest = {"key": key, "fallback": fallback, "files": files}
+            with open(os.path.join(work_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            final_dir = os.path.join(self.root, key)
+            try:
+                os.replace(work_dir, final_dir)
+            except OSError:
+                # Another process published the same key first
+                shutil.rmtree(work_dir, ignore_errors=True)
+            self._evict()
+            return self._read_manifest(key) or manifest
+        except Exception as e:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            logger.warning("Logo derivative build failed: %s", e)
+            return None
+
+    def _touch(self, key):
+        try:
+            os.utime(os.path.join(self.root, key, "manifest.json"))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Least recently used sets go first; hits bump the manifest's mtime
+        with self._evict_lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for key in os.listdir(self.root):
+                directory = os.path.join(self.root, key)
+                if key.startswith(".") or not os.path.isdir(directory):
+                    continue
+                try:
+                    used = os.stat(os.path.join(directory, "manifest.json")).st_mtime
+                    size = sum(entry.stat().st_size for entry in os.scandir(directory))
+                except OSError:
+                    continue
+                entries.append((used, size, key))
+                total += size
+            entries.sort()
+            for used, size, key in entries:
+                if total <= self.max_bytes or now - used < self.grace:
+                    break
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+                total -= size
+
+    def _save(self, img, fmt, path):
+        if fmt == "jpg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif fmt in ("webp", "avif") and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        if fmt in ("png", "gif"):
+            img.save(path, SAVE_FORMATS[fmt], optimize=True)
+        else:
+            img.save(path, SAVE_FORMATS[fmt], quality=self.quality)
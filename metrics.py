@@ -0,0 +1,217 @@
+import contextlib
+import contextvars
+import resource
+import sys
+import threading
+import time
+
+PAGE_SIZE = resource.getpagesize()
+# How often peak_memory() samples resident memory during a render
+RSS_SAMPLE_SECONDS = 0.005
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f"{name}=\"{escape_label(value)}\"" for name, value in pairs) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else format_value(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # Reads its value from a callable at scrape time
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {format_value(self.function())}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, function):
+        metric = Gauge(name, help, function)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    # Resident memory right now; None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+registry = Registry()
+stage_seconds = registry.histogram("website_stage_seconds", "Time spent in each generation stage", ["stage"])
+stage_failures = registry.counter("website_stage_failures_total", "Generation stages that raised", ["stage"])
+generations = registry.counter("website_generations_total", "Generation requests by outcome (built, reused, failed)", ["result"])
+cache_requests = registry.counter("website_cache_requests_total", "Cache lookups by cache and outcome", ["cache", "result"])
+fetch_bytes = registry.counter("website_fetch_bytes_total", "Source HTML bytes downloaded")
+crawl_pages = registry.counter("website_crawl_pages_total", "Pages reached by site crawls by outcome (fetched, duplicate, failed)", ["result"])
+asset_bytes = registry.counter("website_asset_bytes_total", "Page asset bytes downloaded for localization")
+retention_files = registry.counter("website_retention_files_total", "Files deleted by retention (expired, quota, orphan)", ["reason"])
+retention_bytes = registry.counter("website_retention_bytes_total", "Bytes freed by retention")
+optimized_bytes_saved = registry.counter("website_optimized_bytes_saved_total", "Bytes removed from bundle pages by minification")
+bundle_bytes = registry.histogram("website_bundle_bytes", "Size of generated zip bundles", buckets=SIZE_BUCKETS)
+render_peak_growth = registry.histogram("website_render_peak_growth_bytes", "Peak resident memory while rendering a page, over what it was at the start, by mode (tree, stream)", ["mode"], buckets=SIZE_BUCKETS)
+peak_rss = registry.gauge("website_process_peak_rss_bytes", "Highest resident memory this process has reached", peak_rss_bytes)
+request_seconds = registry.histogram("website_http_request_seconds", "HTTP request latency", ["endpoint", "status"])
+
+# Spans recorded while a trace() is active, for per-request breakdowns
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextlib.contextmanager
+def trace():
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def record_span(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_failures.inc(stage=stage)
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def peak_memory(mode):
+    # Highest resident memory seen while the block runs, over what it was
+    # when it started. The process high-water mark only moves for the
+    # largest render so far, so it is sampled instead. Process-wide, so
+    # concurrent renders show up in each other's numbers.
+    before = current_rss_bytes()
+    if before is None:
+        yield
+        return
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], current_rss_bytes() or 0)
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        done.set()
+        sampler.join()
+        peak[0] = max(peak[0], current_rss_bytes() or 0)
+        render_peak_growth.observe(peak[0] - before, mode=mode)
+
+
+def server_timing(spans):
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans)
@@ -1,33 +1,162 @@
-import requests
-from bs4 import BeautifulSoup
+import copy
+import functools
 import json
+import hashlib
+import logging
+import multiprocessing
 import os
-import uuid
-import shutil
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
 import zipfile
-from PIL import Image
+from bundle import BundleWriter, PreviousBundle
+from logo_store import LogoStore, MODERN_FORMATS
+from catalog import CatalogError, CatalogStore, load_catalog
+from page_cache import PageCache, content_key
+from html_cache import HTMLCache, LazySession
+from transform import DocumentIndex, TransformPipeline, TransformRule
+from assets import ASSET_TAGS, LINK_RELS, AssetLocalizer, AssetStore, LocalizedAssets, css_references, fetchable, split_srcset
+from urllib.parse import urldefrag, urljoin
+from retention import shard_path, touch
+from optimize import OutputOptimizer
+from stream_rewrite import PageRewriter, PageScanner, SpooledPage, StreamingUnsupported, builder_tags
+from crawl import SiteCrawler, canonical_url, extract_links
+from preview import PageSkeleton, PreviewCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+NAV_TAGS = ['div', 'nav', 'header', 'center']
+NAV_KEYWORDS = ['search', 'images', 'maps', 'news', 'youtube', 'gmail', 'drive']
+LOGO_TAGS = ['img', 'svg', 'h1', 'h2', 'h3', 'body']
+LOGO_INDICATORS = ["logo", "brand", "site-logo", "nav-logo", "header-logo", "googlelogo", "main"]
+LOGO_STYLE = "max-height: 80px; display: block; margin: 20px auto;"
+FORM_TAGS = ['form', 'button', 'input']
+# Bump when render_section_page's markup changes to invalidate cached pages
+SECTION_TEMPLATE_VERSION = 1
+# Bump when the bundle layout or any transform changes so result keys change
+BUNDLE_VERSION = 1
+# Copy CSS, images, fonts and scripts into the bundle (per request override)
+LOCALIZE_ASSETS = os.environ.get("LOCALIZE_ASSETS", "0") == "1"
+# Minify pages and add .gz/.br siblings for static hosts (per request override)
+OPTIMIZE_OUTPUT = os.environ.get("OPTIMIZE_OUTPUT", "0") == "1"
+# Build on the last bundle made from the same page, copying every artifact
+# whose inputs did not change
+INCREMENTAL_BUILDS = os.environ.get("INCREMENTAL_BUILDS", "1") == "1"
+# Bundle manifests and the newest bundle per page; private, so they are kept
+# out of the generated folder that /download serves
+BUILD_CACHE_DIR = os.environ.get("BUILD_CACHE_DIR", os.path.join("cache", "builds"))
+# Pages at least this many characters long are rewritten in two streaming
+# passes over a spooled copy instead of through a parse tree; 0 disables it
+LOW_MEMORY_THRESHOLD = int(os.environ.get("LOW_MEMORY_THRESHOLD", 2 * 1024 * 1024))
+# Clone every same-origin page the start page links to, not just the one
+CRAWL_SITE = os.environ.get("CRAWL_SITE", "0") == "1"
+# Crawled pages are parsed and rewritten in this many worker processes
+CRAWL_WORKERS = int(os.environ.get("CRAWL_WORKERS", os.cpu_count() or 1))
+
+# BeautifulSoup tree builders: lxml is fastest, html5lib parses like a browser
+PARSER_BACKENDS = ["html.parser", "lxml", "html5lib"]
+DEFAULT_PARSER = os.environ.get("HTML_PARSER", "html.parser")
+
+# Shared connection pool and on-disk cache of fetched source pages
+http_session = LazySession(
+    pool_connections=int(os.environ.get("HTTP_POOL_CONNECTIONS", 10)),
+    pool_maxsize=int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+)
+html_cache = HTMLCache(
+    cache_dir=os.environ.get("HTML_CACHE_DIR", os.path.join("cache", "html")),
+    ttl=int(os.environ.get("HTML_CACHE_TTL", 300)),
+    max_bytes=int(os.environ.get("HTML_CACHE_MAX_BYTES", 50 * 1024 * 1024)),
+    session=http_session,
+    max_body_bytes=int(os.environ.get("HTML_FETCH_MAX_BYTES", 10 * 1024 * 1024)),
+    deadline=float(os.environ.get("HTML_FETCH_DEADLINE", 30))
+)
+# Parsed section catalogs, re-read only when the file changes
+catalog_store = CatalogStore(
+    default_path=os.environ.get("CATALOG_PATH", "about.json"),
+    catalog_dir=os.environ.get("CATALOG_DIR", "catalogs"),
+    max_catalogs=int(os.environ.get("CATALOG_CACHE_SIZE", 8))
+)
+
+# Section pages rendered once per catalog version and rewrite settings
+section_page_cache = PageCache(
+    root=os.environ.get("SECTION_CACHE_DIR", os.path.join("cache", "sections")),
+    max_entries=int(os.environ.get("SECTION_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("SECTION_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+)
+
+# In-flight bundle builds, keyed by output path
+bundle_builds = {}
+bundle_builds_guard = threading.Lock()
+
+# Page assets shared across jobs, and the budget for localizing one page
+asset_store = AssetStore(
+    root=os.environ.get("ASSET_CACHE_DIR", os.path.join("cache", "assets")),
+    ttl=int(os.environ.get("ASSET_CACHE_TTL", 86400)),
+    max_bytes=int(os.environ.get("ASSET_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+)
+asset_localizer = AssetLocalizer(
+    asset_store,
+    max_bytes=int(os.environ.get("ASSET_MAX_BYTES", 20 * 1024 * 1024)),
+    max_file_bytes=int(os.environ.get("ASSET_MAX_FILE_BYTES", 5 * 1024 * 1024)),
+    max_count=int(os.environ.get("ASSET_MAX_COUNT", 300)),
+    deadline=float(os.environ.get("ASSET_DEADLINE", 20)),
+    concurrency=int(os.environ.get("ASSET_CONCURRENCY", 16)),
+    per_host=int(os.environ.get("ASSET_HOST_CONCURRENCY", 4))
+)
+
+# Content-addressed logo variants (sizes x formats), reused across uploads
+logo_store = LogoStore(
+    root=os.environ.get("LOGO_CACHE_DIR", os.path.join("cache", "logos")),
+    workers=int(os.environ.get("LOGO_WORKERS", 2)),
+    max_bytes=int(os.environ.get("LOGO_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+)
+
+# Same-origin crawls for crawl mode; links are read in the crawl workers
+site_crawler = SiteCrawler(
+    lambda url: fetch_html(url),
+    extract=lambda html, url: run_in_crawl_pool(extract_links, html, url).result(),
+    max_pages=int(os.environ.get("CRAWL_MAX_PAGES", 200)),
+    max_depth=int(os.environ.get("CRAWL_MAX_DEPTH", 3)),
+    concurrency=int(os.environ.get("CRAWL_CONCURRENCY", 8)),
+    per_host=int(os.environ.get("CRAWL_HOST_CONCURRENCY", 4))
+)
+crawl_pool = None
+crawl_pool_guard = threading.Lock()
+
+# Rewritten main pages with the nav links and logo left as slots, so a new
+# section list or logo only refills them; and the inputs of live previews
+page_skeletons = PreviewCache(
+    "skeleton",
+    max_entries=int(os.environ.get("PREVIEW_CACHE_ENTRIES", 16)),
+    ttl=int(os.environ.get("PREVIEW_CACHE_TTL", 600))
+)
+previews = PreviewCache(
+    "preview",
+    max_entries=int(os.environ.get("PREVIEW_SESSIONS", 256)),
+    ttl=int(os.environ.get("PREVIEW_CACHE_TTL", 600))
+)
 
 def fetch_html(url):
     if not url.startswith("http"):
         raise ValueError("Invalid URL format. Must start with 'http' or 'https'.")
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    content_type = response.headers.get('content-type', '').lower()
-    if 'html' not in content_type:
-        print(f"Error: URL '{url}' does not return HTML content (Content-Type: {content_type})")
-        raise ValueError("Expected HTML content")
-    return response.text
-
-def read_json(file_path):
-    if not os.path.exists(file_path):
-        print(f"Error: File {file_path} does not exist.")
-        return None
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-        if not content.strip():
-            print(f"Error: File {file_path} is empty.")
-            return None
-        return json.loads(content)
+    return html_cache.fetch(url)
+
+def parse_html(html, parser=None):
+    # bs4 and the parser backends are imported on the first parse
+    from bs4 import BeautifulSoup
+
+    parser = parser or DEFAULT_PARSER
+    if parser not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown HTML parser '{parser}'. Choose one of: {', '.join(PARSER_BACKENDS)}")
+    # Fall back to the other backends if the chosen one is missing or fails
+    candidates = [parser] + [backend for backend in PARSER_BACKENDS if backend != parser]
+    for backend in candidates:
+        try:
+            return BeautifulSoup(html, backend)
+        except Exception as e:
+            logger.warning("Parser '%s' failed: %s", backend, e)
+    raise ValueError("Failed to parse HTML with any parser backend.")
 
 def read_config():
     config_path = "config.json"
@@ -58,123 +187,134 @@ def ask_user_sections(options):
         print("Input interrupted. Skipping section selection.")
         return []
 
-def optimize_image(image_path, output_path, max_size=(800, 800)):
-    try:
-        with Image.open(image_path) as img:
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            img.save(output_path, optimize=True, quality=85)
-        return True
-    except Exception as e:
-        print(f"Image optimization failed: {e}")
-        return False
+def derive_logo(logo_filename, image_folder):
+    if not logo_filename:
+        return None
+    return logo_store.derive(os.path.join(image_folder, logo_filename))
+
+def build_logo_tag(soup, logo_set, logo_filename, style):
+    if not logo_set:
+        new_logo = soup.new_tag("img", src=f"images/{logo_filename}")
+        new_logo['style'] = style
+        return new_logo
+
+    def srcset(fmt):
+        return ", ".join(f"images/{f['name']} {f['density']:g}x" for f in logo_set["files"] if f["format"] == fmt)
+
+    fallback = [f for f in logo_set["files"] if f["format"] == logo_set["fallback"]]
+    new_logo = soup.new_tag("img", src=f"images/{fallback[0]['name']}")
+    if len(fallback) > 1:
+        new_logo['srcset'] = srcset(logo_set["fallback"])
+    new_logo['width'] = str(fallback[0]["width"])
+    new_logo['height'] = str(fallback[0]["height"])
+    new_logo['style'] = style
+
+    modern = [fmt for fmt in MODERN_FORMATS if any(f["format"] == fmt for f in logo_set["files"])]
+    if not modern:
+        return new_logo
+    picture = soup.new_tag("picture")
+    for fmt in modern:
+        picture.append(soup.new_tag("source", type=f"image/{fmt}", srcset=srcset(fmt)))
+    picture.append(new_logo)
+    return picture
 
-def replace_top_nav_with_json_links(soup, selected_keys):
+def replace_top_nav_with_json_links(soup, selected_keys, index=None, links=None):
+    if index is None:
+        index = DocumentIndex(soup, NAV_TAGS, NAV_TAGS)
     nav_container = None
-    for tag in soup.find_all(['div', 'nav', 'header', 'center'], recursive=True):
-        if any(keyword in tag.get_text(strip=True).lower() for keyword in ['search', 'images', 'maps', 'news', 'youtube', 'gmail', 'drive']):
+    for tag in index.find_all(NAV_TAGS):
+        if index.text_contains_any(tag, NAV_KEYWORDS):
             nav_container = tag
             break
 
     if not nav_container:
         nav_container = soup.new_tag("div")
         soup.body.insert(0, nav_container)
+    else:
+        index.detach(nav_container, include_self=False)
 
     nav_container.clear()
+    for a_tag in build_nav_links(soup, selected_keys) if links is None else links:
+        nav_container.append(a_tag)
+        index.adopt(a_tag)
+    return soup
+
+def build_nav_links(soup, selected_keys):
+    links = []
     for key in selected_keys:
         a_tag = soup.new_tag("a", href="construction.html")
         a_tag.string = key
         a_tag['style'] = "margin-right: 10px; font-weight: bold; color: purple;"
-        nav_container.append(a_tag)
-    return soup
+        links.append(a_tag)
+    return links
+
+def logo_rank(name, attrs):
+    # Lower is a better logo: .svg images with a logo-like attribute, then
+    # such inline SVGs, then such images, then any SVG, then any image
+    def text(attr):
+        value = attrs.get(attr) or ""
+        return " ".join(value) if isinstance(value, list) else str(value)
+
+    if name == "svg":
+        combined_attrs = " ".join(text(attr) for attr in ("id", "class", "aria-label", "role")).lower()
+        return 1 if any(ind in combined_attrs for ind in LOGO_INDICATORS) else 3
+    combined_attrs = " ".join(text(attr) for attr in ("src", "alt", "id", "class")).lower()
+    if any(ind in combined_attrs for ind in LOGO_INDICATORS):
+        return 0 if text("src").lower().endswith(".svg") else 2
+    return 4
+
+def find_logo(soup, index=None):
+    if index is None:
+        index = DocumentIndex(soup, LOGO_TAGS)
+    # min() keeps the first of equally ranked tags in document order
+    return min(index.find_all(["img", "svg"]), key=lambda tag: logo_rank(tag.name, tag.attrs), default=None)
 
-def find_logo(soup):
-    indicators = ["logo", "brand", "site-logo", "nav-logo", "header-logo", "googlelogo", "main"]
-    for img in soup.find_all("img"):
-        src = img.get("src", "").lower()
-        if src.endswith(".svg"):
-            combined_attrs = " ".join([
-                src,
-                img.get("alt", "").lower(),
-                img.get("id", "").lower(),
-                " ".join(img.get("class", [])).lower()
-            ])
-            if any(ind in combined_attrs for ind in indicators):
-                return img
-
-    for svg in soup.find_all("svg"):
-        combined_attrs = " ".join([
-            svg.get("id", "").lower(),
-            " ".join(svg.get("class", [])).lower(),
-            str(svg.get("aria-label", "")).lower(),
-            str(svg.get("role", "")).lower()
-        ])
-        if any(ind in combined_attrs for ind in indicators):
-            return svg
-
-    for img in soup.find_all("img"):
-        combined_attrs = " ".join([
-            img.get("src", "").lower(),
-            img.get("alt", "").lower(),
-            img.get("id", "").lower(),
-            " ".join(img.get("class", [])).lower()
-        ])
-        if any(ind in combined_attrs for ind in indicators):
-            return img
-
-    return soup.find("svg") or soup.find("img")
-
-def replace_logo(soup, logo_filename, image_folder):
+def replace_logo(soup, logo_filename, image_folder, index=None, logo_set=None, new_logo=None):
     if not logo_filename:
         return
     try:
-        logo_path = os.path.join(image_folder, logo_filename)
-        optimized_logo = f"optimized_{logo_filename}"
-        optimized_path = os.path.join(image_folder, optimized_logo)
-        logo_src = f"images/{logo_filename}"
-        if optimize_image(logo_path, optimized_path):
-            logo_src = f"images/{optimized_logo}"
-            print(f"Using optimized logo: {logo_src}")
-        else:
-            print("Logo optimization failed, using original.")
+        if index is None:
+            index = DocumentIndex(soup, LOGO_TAGS)
+        if new_logo is None:
+            if logo_set is None:
+                logo_set = derive_logo(logo_filename, image_folder)
+            if logo_set:
+                logger.debug("Using optimized logo variants: %d files", len(logo_set["files"]))
+            else:
+                logger.warning("Logo optimization failed, using original.")
+            new_logo = build_logo_tag(soup, logo_set, logo_filename, LOGO_STYLE)
 
-        new_logo = soup.new_tag("img", src=logo_src)
-        new_logo['style'] = "max-height: 80px; display: block; margin: 20px auto;"
-        existing_logo = find_logo(soup)
+        existing_logo = find_logo(soup, index)
 
         if existing_logo:
             tag_type = "SVG" if existing_logo.name == "svg" else "Image"
             if tag_type == "Image" and existing_logo.get("src", "").lower().endswith(".svg"):
                 tag_type = "SVG-referenced Image"
             existing_logo.replace_with(new_logo)
-            print(f"{tag_type} logo replaced with new logo.")
+            index.detach(existing_logo)
+            logger.debug("%s logo replaced with new logo.", tag_type)
             return
 
-        heading = soup.find(["h1", "h2", "h3"])
+        heading = index.find(["h1", "h2", "h3"])
         if heading:
             heading.insert_before(new_logo)
-            print("New logo inserted before heading.")
+            logger.debug("New logo inserted before heading.")
             return
 
-        body_tag = soup.find("body")
+        body_tag = index.find("body")
         if body_tag:
             body_tag.insert(0, new_logo)
-            print("New logo inserted at top of body.")
+            logger.debug("New logo inserted at top of body.")
         else:
             new_body = soup.new_tag("body")
             new_body.insert(0, new_logo)
             soup.append(new_body)
-            print("Created body and inserted new logo at top.")
+            logger.debug("Created body and inserted new logo at top.")
     except Exception as e:
-        print(f"Unexpected error during logo insertion: {e}")
+        logger.error("Unexpected error during logo insertion: %s", e)
 
-def write_static_pages(selected_keys, replacements, output_folder="sections"):
-    os.makedirs(output_folder, exist_ok=True)
-    for key in selected_keys:
-        filename = key.replace(" ", "_").lower() + ".html"
-        full_path = os.path.join(output_folder, filename)
-        if key in replacements:
-            content = replacements[key]
-            html_content = f"""
+def render_section_page(key, content, parser=None):
+    html_content = f"""
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -188,42 +328,204 @@ def write_static_pages(selected_keys, replacements, output_folder="sections"):
 </body>
 </html>
 """
-            # Parse the section page HTML to modify links
-            soup = BeautifulSoup(html_content, "html.parser")
-            soup = replace_all_links_with_construction(soup)
-            soup = redirect_form_submissions(soup)
-            with open(full_path, "w", encoding="utf-8") as f:
-                f.write(str(soup).strip())
-            print(f"Created: {full_path}")
+    # Parse the section page HTML to modify links
+    soup = parse_html(html_content, parser)
+    soup = TransformPipeline(rewrite_rules()).run(soup)
+    return str(soup).strip()
+
+def section_page_key(catalog_version, key, parser=None):
+    settings = {
+        "template": SECTION_TEMPLATE_VERSION,
+        "parser": parser or DEFAULT_PARSER,
+        "construction_page": "construction.html",
+        "submit_page": "submit.html",
+    }
+    return content_key(catalog_version, key, settings)
+
+def section_filename(key):
+    return key.replace(" ", "_").lower() + ".html"
+
+def section_page(key, replacements, parser=None):
+    # Pages from a versioned catalog are rendered once and then reused
+    catalog_version = getattr(replacements, "version", None)
+    content = replacements[key]
+    if catalog_version:
+        return section_page_cache.get(
+            section_page_key(catalog_version, key, parser),
+            lambda: render_section_page(key, content, parser)
+        )
+    return render_section_page(key, content, parser)
+
+def write_static_pages(selected_keys, replacements, output_folder="sections", parser=None, bundle=None):
+    # With a bundle, output_folder is the directory inside the zip
+    if bundle is None:
+        os.makedirs(output_folder, exist_ok=True)
+    for key in selected_keys:
+        filename = section_filename(key)
+        full_path = f"{output_folder}/{filename}" if bundle else os.path.join(output_folder, filename)
+        if key in replacements:
+            write_page(full_path, section_page(key, replacements, parser), bundle)
+            logger.debug("Created: %s", full_path)
         else:
-            print(f"No content found for section: {key}")
+            logger.warning("No content found for section: %s", key)
 
-def replace_all_links_with_construction(soup, construction_page="construction.html"):
-    for a_tag in soup.find_all("a", href=True):
+def replace_all_links_with_construction(soup, construction_page="construction.html", index=None):
+    if index is None:
+        index = DocumentIndex(soup, ["a"])
+    for a_tag in index.find_all("a"):
+        if a_tag.get("href") is None:
+            continue
         a_tag['href'] = construction_page
         if 'target' in a_tag.attrs:
             del a_tag['target']
-    print(f"All links now point to '{construction_page}'")
+    logger.debug("All links now point to '%s'", construction_page)
+    return soup
+
+def link_local_pages(soup, base_url, local_pages, construction_page="construction.html", index=None):
+    # Crawl mode: links to crawled pages go to their local copies, anything
+    # else to construction_page; in-page anchors are left alone
+    if index is None:
+        index = DocumentIndex(soup, ["a", "base"])
+    base = index.find("base")
+    if base is not None and base.get("href"):
+        base_url = urljoin(base_url, base["href"])
+    count = 0
+    for a_tag in index.find_all("a"):
+        href = a_tag.get("href")
+        if href is None or href.startswith("#"):
+            continue
+        url, fragment = urldefrag(urljoin(base_url, href.strip()))
+        local = local_pages.get(canonical_url(url))
+        if local:
+            a_tag['href'] = f"{local}#{fragment}" if fragment else local
+            count += 1
+        else:
+            a_tag['href'] = construction_page
+        if 'target' in a_tag.attrs:
+            del a_tag['target']
+    logger.debug("%d links point at crawled pages, the rest at '%s'", count, construction_page)
     return soup
 
-def redirect_form_submissions(soup, submit_page="submit.html"):
-    for form in soup.find_all("form"):
+def redirect_form_submissions(soup, submit_page="submit.html", index=None):
+    if index is None:
+        index = DocumentIndex(soup, FORM_TAGS)
+    for form in index.find_all("form"):
         form['action'] = submit_page
-        print(f"Form action changed to '{submit_page}'")
+        logger.debug("Form action changed to '%s'", submit_page)
 
-    for btn in soup.find_all(["button", "input"]):
+    for btn in index.find_all(["button", "input"]):
         btn_type = btn.get("type", "").lower()
         if btn_type == "submit":
             if btn.name == "input":
                 btn['formaction'] = submit_page
             elif btn.name == "button":
                 btn['onclick'] = f"location.href='{submit_page}'; return false;"
-            print(f"Submit button redirected to '{submit_page}'")
+            logger.debug("Submit button redirected to '%s'", submit_page)
+    return soup
+
+def localize_assets(soup, base_url, localized, index=None):
+    if index is None:
+        index = DocumentIndex(soup, ASSET_TAGS)
+    base = index.find("base")
+    if base is not None and base.get("href"):
+        base_url = urljoin(base_url, base["href"])
+        base.decompose()
+
+    def resolve(ref):
+        ref = (ref or "").strip()
+        if not ref or ref.startswith(("data:", "#", "javascript:")):
+            return None
+        url = urljoin(base_url, ref)
+        return url if fetchable(url) else None
+
+    # (tag, attribute) pairs whose value is a single asset URL
+    references = []
+    for link in index.find_all("link"):
+        if LINK_RELS.intersection(rel.lower() for rel in link.get("rel", [])):
+            references.append((link, "href"))
+    for tag in index.find_all(["img", "source", "script"]):
+        references.append((tag, "src"))
+    for video in index.find_all("video"):
+        references.append((video, "poster"))
+    srcsets = index.find_all(["img", "source"])
+    styles = index.find_all("style")
+    styled = soup.find_all(style=True)
+
+    urls = [resolve(tag.get(attr)) for tag, attr in references]
+    for tag in srcsets:
+        urls.extend(resolve(url) for url, _ in split_srcset(tag.get("srcset", "")))
+    for css in [tag.string or "" for tag in styles] + [tag["style"] for tag in styled]:
+        urls.extend(resolve(ref) for _, ref in css_references(css.encode("utf-8")))
+
+    records = asset_localizer.fetch_all([url for url in urls if url])
+
+    # Anything not downloaded is made absolute so it still loads from the
+    # origin now that <base> is gone
+    count = 0
+    for tag, attr in references:
+        url = resolve(tag.get(attr))
+        path = localized.path_for(url, records)
+        if path:
+            tag[attr] = path
+            # The copy may be rewritten, and is same-origin now anyway
+            tag.attrs.pop("integrity", None)
+            tag.attrs.pop("crossorigin", None)
+            count += 1
+        elif url:
+            tag[attr] = url
+    for tag in srcsets:
+        if tag.get("srcset"):
+            candidates = []
+            for ref, descriptor in split_srcset(tag["srcset"]):
+                url = resolve(ref)
+                candidates.append(f"{localized.path_for(url, records) or url or ref} {descriptor}".strip())
+            tag["srcset"] = ", ".join(candidates)
+    for tag in styles:
+        if tag.string:
+            tag.string = localized.rewrite_css(tag.string.encode("utf-8"), base_url, records, f"{localized.folder}/").decode("utf-8")
+    for tag in styled:
+        tag["style"] = localized.rewrite_css(tag["style"].encode("utf-8"), base_url, records, f"{localized.folder}/").decode("utf-8")
+    logger.debug("Localized %d asset references into %d files", count, len(localized.entries))
     return soup
 
-def create_construction_and_submit_pages(output_dir):
-    # Create construction.html
-    construction_content = """
+def rewrite_rules(construction_page="construction.html", submit_page="submit.html", local_pages=None, base_url=""):
+    if local_pages is None:
+        links = TransformRule(lambda soup, index: replace_all_links_with_construction(soup, construction_page, index), ["a"], name="links")
+    else:
+        links = TransformRule(lambda soup, index: link_local_pages(soup, base_url, local_pages, construction_page, index), ["a", "base"], name="links")
+    return [
+        links,
+        TransformRule(lambda soup, index: redirect_form_submissions(soup, submit_page, index), FORM_TAGS, name="forms")
+    ]
+
+def website_rules(selected_keys, logo_filename, image_folder, logo_set=None, base_url="", localized=None, local_pages=None, template=None):
+    # Every rule shares the single DocumentIndex walk done by TransformPipeline.
+    # A template from parse_template supplies ready-made nav links and logo.
+    def nav_links():
+        return None if template is None else [copy.copy(a_tag) for a_tag in template[0]]
+
+    def new_logo():
+        return None if template is None or template[1] is None else copy.copy(template[1])
+
+    rules = [
+        TransformRule(lambda soup, index: replace_top_nav_with_json_links(soup, selected_keys, index, nav_links()), NAV_TAGS, NAV_TAGS, name="nav"),
+        TransformRule(lambda soup, index: replace_logo(soup, logo_filename, image_folder, index, logo_set, new_logo()), LOGO_TAGS, name="logo")
+    ]
+    if localized is not None:
+        # After the logo rule, so the replaced logo is not downloaded
+        rules.append(TransformRule(lambda soup, index: localize_assets(soup, base_url, localized, index), ASSET_TAGS, name="assets"))
+    return rules + rewrite_rules(local_pages=local_pages, base_url=base_url)
+
+def write_page(path, content, bundle=None):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if bundle is not None:
+        bundle.add_bytes(path, content)
+        return
+    with open(path, "wb") as f:
+        f.write(content)
+
+CONSTRUCTION_PAGE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -235,13 +537,9 @@ def create_construction_and_submit_pages(output_dir):
     <p>This page is currently under construction. Please check back later!</p>
 </body>
 </html>
-"""
-    with open(os.path.join(output_dir, "construction.html"), "w", encoding="utf-8") as f:
-        f.write(construction_content.strip())
-    print("Created: construction.html")
+""".strip()
 
-    # Create submit.html
-    submit_content = """
+SUBMIT_PAGE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -254,113 +552,599 @@ def create_construction_and_submit_pages(output_dir):
     <p><a href="construction.html">Back to Construction Page</a></p>
 </body>
 </html>
-"""
-    with open(os.path.join(output_dir, "submit.html"), "w", encoding="utf-8") as f:
-        f.write(submit_content.strip())
-    print("Created: submit.html")
+""".strip()
+
+def create_construction_and_submit_pages(output_dir, bundle=None):
+    write_page("construction.html" if bundle else os.path.join(output_dir, "construction.html"), CONSTRUCTION_PAGE, bundle)
+    logger.debug("Created: construction.html")
+    write_page("submit.html" if bundle else os.path.join(output_dir, "submit.html"), SUBMIT_PAGE, bundle)
+    logger.debug("Created: submit.html")
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def process_website(url, json_path, image_folder, image_filenames, selected_sections, output_folder):
+def result_key(html, url, replacements, selected_keys, logo_path, parser=None, assets=False, optimize=False, streamed=False, site=None):
+    catalog_version = getattr(replacements, "version", None) or content_key(dict(replacements))
+    parts = [
+        BUNDLE_VERSION,
+        hashlib.sha256(html.encode("utf-8")).hexdigest(),
+        catalog_version,
+        sorted(selected_keys),
+        file_digest(logo_path) if logo_path else None,
+        parser or DEFAULT_PARSER
+    ]
+    if assets:
+        # Asset URLs resolve against the page's own address, so the same
+        # HTML from another origin localizes different files
+        parts.extend(["assets", url])
+    if optimize:
+        parts.append("optimize")
+    if streamed:
+        parts.append("stream")
+    if site is not None:
+        parts.append(site["key"])
+    return content_key(*parts)
+
+def build_settings(optimize):
+    # Bundles built under different settings never share artifacts
+    return {
+        "bundle": BUNDLE_VERSION,
+        "section_template": SECTION_TEMPLATE_VERSION,
+        "optimize": bool(optimize),
+    }
+
+def artifact_hashes(html, url, selected_keys, logo_filename, logo_path, parser=None, assets=False, streamed=False, site=None):
+    # Input hashes for the artifacts built from the page and the logo;
+    # section pages are hashed per key by section_artifact_key
+    logo = content_key(logo_filename, file_digest(logo_path), logo_store.params()) if logo_filename else None
+    parts = [
+        hashlib.sha256(html.encode("utf-8")).hexdigest(),
+        url if assets else None,
+        selected_keys,
+        logo,
+        parser or DEFAULT_PARSER,
+        bool(assets)
+    ]
+    if streamed:
+        parts.append("stream")
+    if site is not None:
+        # Crawled pages and the assets they share are one artifact with the
+        # start page, rebuilt together
+        parts.append(site["key"])
+    return {"logo": logo, "page": content_key(*parts)}
+
+def low_memory(html, assets):
+    # Asset localization needs every URL and <style> block up front, so
+    # those pages keep the tree
+    return bool(LOW_MEMORY_THRESHOLD) and not assets and len(html) >= LOW_MEMORY_THRESHOLD
+
+def section_artifact_key(key, content, parser=None):
+    return content_key(key, content, parser or DEFAULT_PARSER)
+
+def manifest_path(zip_path):
+    return shard_path(os.path.join(BUILD_CACHE_DIR, "manifests"), os.path.basename(zip_path)[:-len(".zip")] + ".json")
+
+def lineage_path(output_folder, url):
+    # Points at the newest bundle built from this page into output_folder
+    return shard_path(os.path.join(BUILD_CACHE_DIR, "latest"), f"latest_{content_key(os.path.abspath(output_folder), url)[:32]}.json")
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def find_previous(output_folder, url, settings):
     try:
-        html = fetch_html(url) if url.startswith("http") else open(url, 'r', encoding='utf-8').read()
-        soup = BeautifulSoup(html, "html.parser")
-        print("HTML fetched successfully")
-    except Exception as e:
-        print(f"Failed to fetch HTML: {str(e)}")
+        with open(lineage_path(output_folder, url), "r", encoding="utf-8") as f:
+            previous_zip = shard_path(output_folder, json.load(f)["bundle"])
+        with open(manifest_path(previous_zip), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["settings"] != settings:
+            return None
+        return PreviousBundle(previous_zip, manifest["artifacts"])
+    except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile) as e:
+        logger.debug("No previous bundle to build on: %s", e)
+        return None
+
+def record_build(output_folder, url, zip_path, settings, bundle):
+    # Failing to record only costs the next build its head start
+    lineage = lineage_path(output_folder, url)
+    try:
+        write_json(manifest_path(zip_path), {
+            "bundle": os.path.basename(zip_path),
+            "settings": settings,
+            "artifacts": bundle.artifacts,
+            "lineage": lineage,
+        })
+        write_json(lineage, {"bundle": os.path.basename(zip_path)})
+    except OSError as e:
+        logger.warning("Failed to write build manifest: %s", e)
+
+def forget_build(zip_path):
+    # The bundle is gone: drop its manifest, and the page's pointer if it
+    # still names this bundle. Build records have no age of their own.
+    path = manifest_path(zip_path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lineage = json.load(f).get("lineage")
+        if lineage:
+            with open(lineage, "r", encoding="utf-8") as f:
+                if json.load(f).get("bundle") == os.path.basename(zip_path):
+                    os.remove(lineage)
+    except (OSError, ValueError, AttributeError) as e:
+        logger.debug("Build records for %s: %s", zip_path, e)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def log_optimization(optimizer):
+    if optimizer is not None and optimizer.report:
+        saved = sum(entry["saved"] for entry in optimizer.report)
+        logger.info("Optimized %d files, %d bytes saved by minifying: %s", len(optimizer.report), saved, optimizer.describe())
+
+def copy_to_stream(path, stream):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            stream.write(chunk)
+
+def process_website(url, catalog, image_folder, image_filenames, selected_sections, output_folder, parser=None, stream=None, assets=None, optimize=None, crawl=None):
+    try:
+        with metrics.span("total"):
+            return generate(url, catalog, image_folder, image_filenames, selected_sections, output_folder, parser, stream, assets, optimize, crawl)
+    except Exception:
+        metrics.generations.inc(result="failed")
         raise
 
+def generate(url, catalog, image_folder, image_filenames, selected_sections, output_folder, parser=None, stream=None, assets=None, optimize=None, crawl=None):
+    if assets is None:
+        assets = LOCALIZE_ASSETS
+    if optimize is None:
+        optimize = OPTIMIZE_OUTPUT
+    if crawl is None:
+        crawl = CRAWL_SITE
     try:
-        output_dir = os.path.join(output_folder, str(uuid.uuid4()))
-        os.makedirs(output_dir, exist_ok=True)
-        os.makedirs(os.path.join(output_dir, "images"), exist_ok=True)
-        os.makedirs(os.path.join(output_dir, "sections"), exist_ok=True)
-        print(f"Output directory created: {output_dir}")
+        with metrics.span("fetch"):
+            html = fetch_html(url) if url.startswith("http") else open(url, 'r', encoding='utf-8').read()
+        logger.debug("HTML fetched successfully")
     except Exception as e:
-        print(f"Failed to create output directory: {str(e)}")
+        logger.error("Failed to fetch HTML: %s", e)
         raise
 
     try:
-        replacements = read_json(json_path)
+        # Callers normally pass the parsed catalog; a path is still accepted
+        if isinstance(catalog, str):
+            catalog = load_catalog(catalog)
+        replacements = catalog
         if not replacements:
             raise ValueError("Failed to read JSON.")
-        print("JSON read successfully")
+        logger.debug("JSON read successfully")
     except Exception as e:
-        print(f"Failed to read JSON: {str(e)}")
+        logger.error("Failed to read JSON: %s", e)
         raise
 
-    selected_keys = [key for key in selected_sections if key in replacements]
+    # Catalog order, so the output depends only on which sections were picked
+    selected = set(selected_sections)
+    selected_keys = [key for key in replacements.keys() if key in selected]
     if not selected_keys:
-        print("No valid sections selected")
+        logger.error("No valid sections selected")
         raise ValueError("No valid sections selected.")
-    print(f"Selected JSON keys: {selected_keys}")
+    logger.debug("Selected JSON keys: %s", selected_keys)
 
     logo_filename = image_filenames[0] if image_filenames else None
-    print(f"Logo: {logo_filename}")
+    logger.debug("Logo: %s", logo_filename)
 
-    try:
-        soup = replace_top_nav_with_json_links(soup, selected_keys)
-        replace_logo(soup, logo_filename, image_folder)
-        # Apply the link and form redirection
-        soup = replace_all_links_with_construction(soup)
-        soup = redirect_form_submissions(soup)
-        print("HTML processed successfully")
-    except Exception as e:
-        print(f"Failed to process HTML: {str(e)}")
-        raise
+    site = None
+    if crawl:
+        if not url.startswith("http"):
+            raise ValueError("Crawl mode needs an http or https URL.")
+        with metrics.span("crawl"):
+            site = crawl_site(url, html)
+
+    # Crawled pages go through the tree in the crawl workers
+    streamed = low_memory(html, assets) and site is None
+    # Identical inputs map to the same bundle name, so repeats are free
+    with metrics.span("result_key"):
+        key = result_key(html, url, replacements, selected_keys, os.path.join(image_folder, logo_filename) if logo_filename else None, parser, assets, optimize, streamed, site)
+    zip_filename = f"website_{key[:32]}.zip"
+    zip_path = shard_path(output_folder, zip_filename)
+    settings = build_settings(optimize)
 
+    def start_bundle(**target):
+        nonlocal html
+        hashes = artifact_hashes(html, url, selected_keys, logo_filename, os.path.join(image_folder, logo_filename) if logo_filename else None, parser, assets, streamed, site)
+        previous = find_previous(output_folder, url, settings) if INCREMENTAL_BUILDS else None
+        optimizer = OutputOptimizer() if optimize else None
+        bundle = BundleWriter(optimizer=optimizer, previous=previous, **target)
+        if streamed:
+            # From here on the page is read back from disk, so the text can go
+            html = None if bundle.can_reuse("page", hashes["page"]) else SpooledPage(html)
+        return bundle, hashes, optimizer
+
+    def finish_bundle(bundle, optimizer):
+        log_optimization(optimizer)
+        if bundle.reused:
+            metrics.generations.inc(result="incremental")
+            logger.info("Reused %d of %d artifacts from %s", len(bundle.reused), len(bundle.artifacts), os.path.basename(bundle.previous.path))
+        else:
+            metrics.generations.inc(result="built")
+
+    if stream is not None:
+        if os.path.exists(zip_path):
+            touch(zip_path)
+            with metrics.span("zip"):
+                copy_to_stream(zip_path, stream)
+            metrics.generations.inc(result="reused")
+            logger.info("Reused existing zip file: %s", zip_path)
+        else:
+            bundle, hashes, optimizer = start_bundle(fileobj=stream)
+            build_website(html, url, replacements, selected_keys, logo_filename, image_folder, parser, assets, bundle, hashes, site)
+            finish_bundle(bundle, optimizer)
+            logger.info("Zip streamed to client")
+        return None
+
+    def build():
+        if os.path.exists(zip_path):
+            touch(zip_path)
+            metrics.generations.inc(result="reused")
+            logger.info("Reused existing zip file: %s", zip_path)
+            return zip_filename
+        try:
+            os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+            bundle, hashes, optimizer = start_bundle(path=zip_path)
+        except Exception as e:
+            logger.error("Failed to create zip file: %s", e)
+            raise
+        build_website(html, url, replacements, selected_keys, logo_filename, image_folder, parser, assets, bundle, hashes, site)
+        finish_bundle(bundle, optimizer)
+        record_build(output_folder, url, zip_path, settings, bundle)
+        metrics.bundle_bytes.observe(os.path.getsize(zip_path))
+        logger.info("Zip file created: %s", zip_path)
+        return zip_filename
+
+    # Concurrent identical requests wait on the build already in flight
+    with bundle_builds_guard:
+        future = bundle_builds.get(zip_path)
+        leader = future is None
+        if leader:
+            future = bundle_builds[zip_path] = Future()
+    if not leader:
+        result = future.result()
+        metrics.generations.inc(result="coalesced")
+        return result
     try:
-        if logo_filename:
-            src = os.path.join(image_folder, logo_filename)
-            optimized_logo = f"optimized_{logo_filename}"
-            optimized_path = os.path.join(image_folder, optimized_logo)
-            dest = os.path.join(output_dir, "images", optimized_logo if os.path.exists(optimized_path) else logo_filename)
-            shutil.copy(src if not os.path.exists(optimized_path) else optimized_path, dest)
-            print(f"Copied logo: {dest}")
+        result = build()
+        future.set_result(result)
+        return result
     except Exception as e:
-        print(f"Failed to copy logo: {str(e)}")
+        future.set_exception(e)
         raise
+    finally:
+        with bundle_builds_guard:
+            bundle_builds.pop(zip_path, None)
+
+def build_website(html, url, replacements, selected_keys, logo_filename, image_folder, parser, assets, bundle, hashes, site=None):
+    # Every artifact goes straight into the archive (or the client stream);
+    # a failed build leaves no partial zip behind. Artifacts whose input hash
+    # matches the previous bundle are copied from it instead of rebuilt.
+    with bundle:
+        logo_set = None
+        page = localized = None
+        site_pages = []
+        reuse_logo = bundle.can_reuse("logo", hashes["logo"])
+        reuse_page = bundle.can_reuse("page", hashes["page"])
+        if not (reuse_logo and reuse_page):
+            with metrics.span("logo_derive"):
+                logo_set = derive_logo(logo_filename, image_folder)
+        if not reuse_page and site is not None:
+            # The workers rewrite the other pages while this one renders
+            site_pages = render_site(site, selected_keys, logo_filename, parser, assets, logo_set)
+        if not reuse_page and not isinstance(html, SpooledPage):
+            with metrics.peak_memory("tree"):
+                page, localized = render_page(html, url, logo_filename, image_folder, parser, assets, selected_keys, logo_set, site["local_pages"] if site else None)
+
+        with metrics.span("zip"):
+            if not bundle.artifact("logo", hashes["logo"]):
+                try:
+                    if logo_set:
+                        for logo_file in logo_set["files"]:
+                            bundle.add_file(f"images/{logo_file['name']}", logo_store.file_path(logo_set, logo_file["name"]))
+                        logger.debug("Copied logo variants: %d files", len(logo_set["files"]))
+                    elif logo_filename:
+                        bundle.add_file(f"images/{logo_filename}", os.path.join(image_folder, logo_filename))
+                        logger.debug("Copied logo: %s", bundle.entries[-1])
+                except Exception as e:
+                    logger.error("Failed to copy logo: %s", e)
+                    raise
 
+            if not bundle.artifact("page", hashes["page"]):
+                written = set()
+                try:
+                    if localized is not None:
+                        add_localized(bundle, localized.folder, localized.entries, written)
+                        logger.debug("Copied %d page assets", len(localized.entries))
+                except Exception as e:
+                    logger.error("Failed to copy page assets: %s", e)
+                    raise
+
+                try:
+                    if page is None:
+                        with metrics.peak_memory("stream"):
+                            stream_page(html, url, logo_filename, image_folder, parser, selected_keys, logo_set, bundle)
+                    else:
+                        bundle.add_text("modified_website.html", page)
+                    logger.debug("Main HTML written")
+                except Exception as e:
+                    logger.error("Failed to write main HTML: %s", e)
+                    raise
+
+                try:
+                    # Assets already written for an earlier page are shared
+                    for name, future in site_pages:
+                        site_page, entries = future.result()
+                        add_localized(bundle, "assets", entries, written)
+                        bundle.add_text(name, site_page)
+                    if site_pages:
+                        logger.debug("Crawled pages written: %d", len(site_pages))
+                except Exception as e:
+                    logger.error("Failed to write crawled pages: %s", e)
+                    raise
+
+        with metrics.span("sections"):
+            try:
+                for key in selected_keys:
+                    if key in replacements and bundle.artifact(f"section:{key}", section_artifact_key(key, replacements[key], parser)):
+                        continue
+                    write_static_pages([key], replacements, "sections", parser, bundle)
+            except Exception as e:
+                logger.error("Failed to write static pages: %s", e)
+                raise
+
+            try:
+                if not bundle.artifact("static", BUNDLE_VERSION):
+                    create_construction_and_submit_pages("", bundle)
+            except Exception as e:
+                logger.error("Failed to create construction and submit pages: %s", e)
+                raise
+
+def render_page(html, url, logo_filename, image_folder, parser, assets, selected_keys, logo_set, local_pages=None):
+    # The rewritten main page, plus the assets it was localized with
+    if not assets and local_pages is None:
+        if logo_filename and logo_set is None:
+            logo_set = derive_logo(logo_filename, image_folder)
+        nav_html, logo_html = header_markup(selected_keys, logo_filename, logo_set)
+        return page_skeleton(html, parser, bool(logo_filename)).fill(nav=nav_html, logo=logo_html), None
+    localized = LocalizedAssets(asset_store) if assets else None
+    rules = website_rules(selected_keys, logo_filename, image_folder, logo_set, url if fetchable(url) else "", localized, local_pages)
+    return rewrite_tree(html, parser, rules), localized
+
+def rewrite_tree(html, parser, rules):
     try:
-        with open(os.path.join(output_dir, "modified_website.html"), "w", encoding="utf-8") as f:
-            f.write(str(soup))
-        print("Main HTML written")
+        with metrics.span("parse"):
+            soup = parse_html(html, parser)
     except Exception as e:
-        print(f"Failed to write main HTML: {str(e)}")
+        logger.error("Failed to parse HTML: %s", e)
         raise
 
     try:
-        write_static_pages(selected_keys, replacements, os.path.join(output_dir, "sections"))
+        # Nav, logo, asset, link and form rewrites in one traversal
+        soup = TransformPipeline(rules).run(soup, metrics.span)
+        logger.debug("HTML processed successfully")
     except Exception as e:
-        print(f"Failed to write static pages: {str(e)}")
+        logger.error("Failed to process HTML: %s", e)
         raise
 
     try:
-        create_construction_and_submit_pages(output_dir)
+        with metrics.span("serialize"):
+            return str(soup)
     except Exception as e:
-        print(f"Failed to create construction and submit pages: {str(e)}")
+        logger.error("Failed to serialize HTML: %s", e)
         raise
 
+def skeleton_key(html, parser=None, with_logo=True):
+    return content_key(hashlib.sha256(html.encode("utf-8")).hexdigest(), parser or DEFAULT_PARSER, with_logo)
+
+def page_skeleton(html, parser=None, with_logo=True, key=None):
+    # Only the nav links and logo depend on the sections and logo, so the
+    # rest of the page is parsed and rewritten once and then reused from
+    # memory; the slots stand where the rules would put those tags
+    def build():
+        from bs4 import Comment
+
+        markers = PageSkeleton.markers("nav", "logo")
+        template = ([Comment(markers["nav"])], Comment(markers["logo"]))
+        rules = website_rules([], "logo" if with_logo else None, "", template=template)
+        return PageSkeleton(rewrite_tree(html, parser, rules), markers)
+
+    return page_skeletons.get_or_build(key or skeleton_key(html, parser, with_logo), build)
+
+def start_preview(url, catalog, selected_sections, logo_filename, image_folder, parser=None, assets=None, optimize=None, crawl=None):
+    # Checks the inputs and renders the page once, so fetch and parse errors
+    # surface here; returns the id the preview is served under. The assets,
+    # optimize and crawl flags are kept for the export.
+    selected = set(selected_sections)
+    selected_keys = [key for key in catalog.keys() if key in selected]
+    if not selected_keys:
+        raise ValueError("No valid sections selected.")
+    catalog_version = getattr(catalog, "version", None) or content_key(dict(catalog))
+    preview_id = content_key(url, catalog_version, selected_keys, logo_filename, parser or DEFAULT_PARSER, assets, optimize, crawl)[:32]
+    preview = {
+        "url": url,
+        "catalog": catalog,
+        "selected_keys": selected_keys,
+        "logo_filename": logo_filename,
+        "image_folder": image_folder,
+        "parser": parser,
+        "assets": assets,
+        "optimize": optimize,
+        "crawl": crawl,
+    }
+    preview_page(preview)
+    previews.put(preview_id, preview)
+    return preview_id
+
+def preview_page(preview):
+    # The page the bundle's modified_website.html would hold. The source is
+    # fetched and parsed only when its skeleton is no longer cached.
+    with_logo = bool(preview["logo_filename"])
+    skeleton = page_skeletons.get(preview["skeleton"]) if "skeleton" in preview else None
+    if skeleton is None:
+        html = fetch_html(preview["url"])
+        preview["skeleton"] = skeleton_key(html, preview["parser"], with_logo)
+        skeleton = page_skeleton(html, preview["parser"], with_logo, preview["skeleton"])
+    if "header" not in preview:
+        preview["logo_set"] = derive_logo(preview["logo_filename"], preview["image_folder"])
+        preview["header"] = header_markup(preview["selected_keys"], preview["logo_filename"], preview["logo_set"])
+    nav_html, logo_html = preview["header"]
+    return skeleton.fill(nav=nav_html, logo=logo_html)
+
+def preview_file(preview, name):
+    # ("data", bytes) or ("file", path) for a path inside the bundle, or None
+    if name == "modified_website.html":
+        return "data", preview_page(preview).encode("utf-8")
+    if name == "construction.html":
+        return "data", CONSTRUCTION_PAGE.encode("utf-8")
+    if name == "submit.html":
+        return "data", SUBMIT_PAGE.encode("utf-8")
+    folder, _, filename = name.rpartition("/")
+    if folder == "sections":
+        for key in preview["selected_keys"]:
+            if section_filename(key) == filename:
+                page = section_page(key, preview["catalog"], preview["parser"])
+                return "data", page if isinstance(page, bytes) else page.encode("utf-8")
+    elif folder == "images" and preview["logo_filename"]:
+        if "header" not in preview:
+            preview_page(preview)
+        logo_set = preview["logo_set"]
+        if logo_set:
+            if any(logo_file["name"] == filename for logo_file in logo_set["files"]):
+                return "file", logo_store.file_path(logo_set, filename)
+        elif filename == preview["logo_filename"]:
+            return "file", os.path.join(preview["image_folder"], filename)
+    return None
+
+def stream_page(source, url, logo_filename, image_folder, parser, selected_keys, logo_set, bundle):
+    # Low-memory counterpart of render_page for a SpooledPage: one pass finds
+    # the nav container, logo and insertion points, a second writes the
+    # rewritten markup straight into the bundle entry
+    with source:
+        try:
+            with metrics.span("scan"):
+                scanner = PageScanner(NAV_TAGS, NAV_KEYWORDS, logo_rank if logo_filename else None)
+                scanner.run(source.chunks())
+                plan = scanner.plan()
+        except StreamingUnsupported as e:
+            logger.info("Low-memory mode does not apply (%s); rendering the tree instead", e)
+            page, _ = render_page(source.read(), url, logo_filename, image_folder, parser, False, selected_keys, logo_set)
+            bundle.add_text("modified_website.html", page)
+            return
+
+        nav_html, logo_html = header_markup(selected_keys, logo_filename, logo_set)
+        with metrics.span("rewrite"), bundle.open_text("modified_website.html") as write:
+            PageRewriter(plan, nav_html, logo_html, write).run(source.chunks())
+        logger.info("Rewrote a %d character page in low-memory mode", source.size)
+
+def run_in_crawl_pool(fn, *args):
+    # Spawned rather than forked, since the app has threads running; pools
+    # cannot be started from daemonic workers, which run fn in place
+    global crawl_pool
+    if CRAWL_WORKERS > 1 and not multiprocessing.current_process().daemon:
+        with crawl_pool_guard:
+            if crawl_pool is None:
+                crawl_pool = ProcessPoolExecutor(max_workers=CRAWL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return crawl_pool.submit(fn, *args)
+    future = Future()
     try:
-        zip_filename = f"website_{uuid.uuid4()}.zip"
-        zip_path = os.path.join(output_folder, zip_filename)
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, output_dir)
-                    zipf.write(file_path, arcname)
-        print(f"Zip file created: {zip_path}")
+        future.set_result(fn(*args))
     except Exception as e:
-        print(f"Failed to create zip file: {str(e)}")
-        raise
+        future.set_exception(e)
+    return future
+
+def crawl_site(url, html):
+    site = site_crawler.crawl(url, html)
+    site["key"] = content_key(
+        [(page["url"], page["name"], page["digest"]) for page in site["pages"]],
+        sorted(site["local_pages"].items())
+    )
+    logger.info("Crawled %d pages from %s (%d aliases, %d failed)", len(site["pages"]), url,
+                len(site["local_pages"]) - len(site["pages"]), site["failed"])
+    return site
+
+def header_markup(selected_keys, logo_filename, logo_set):
+    # The nav links and logo markup the rules insert, for pages rewritten
+    # without building those tags in their own tree
+    scratch = parse_html("", "html.parser")
+    nav_html = "".join(str(a_tag) for a_tag in build_nav_links(scratch, selected_keys))
+    logo_html = str(build_logo_tag(scratch, logo_set, logo_filename, LOGO_STYLE)) if logo_filename else ""
+    return nav_html, logo_html
 
+@functools.lru_cache(maxsize=8)
+def parse_template(nav_html, logo_html):
+    # Parsed once per worker; every page gets copies of these tags
+    soup = parse_html(f"<div>{nav_html}</div><div>{logo_html}</div>", "html.parser")
+    nav, logo = soup.find_all("div", recursive=False)
+    return list(nav.children), next(iter(logo.children), None)
+
+def render_site_page(html, url, selected_keys, logo_filename, parser, assets, local_pages, template):
+    # render_page for one crawled page, run in a crawl worker process
+    soup = parse_html(html, parser)
+    localized = LocalizedAssets(asset_store) if assets else None
+    rules = website_rules(selected_keys, logo_filename, "", None, url, localized, local_pages, parse_template(*template))
+    TransformPipeline(rules).run(soup)
+    return str(soup), (localized.entries if localized is not None else {})
+
+def render_site(site, selected_keys, logo_filename, parser, assets, logo_set):
+    # Hands every crawled page but the start page to the crawl workers;
+    # returns (file name, future) pairs in crawl order
+    template = header_markup(selected_keys, logo_filename, logo_set)
+    return [
+        (page["name"], run_in_crawl_pool(render_site_page, page["html"], page["url"], selected_keys, logo_filename, parser, assets, site["local_pages"], template))
+        for page in site["pages"] if page["depth"] > 0
+    ]
+
+def add_localized(bundle, folder, entries, written):
+    for name, (kind, value) in sorted(entries.items()):
+        path = f"{folder}/{name}"
+        if path in written:
+            continue
+        written.add(path)
+        if kind == "file":
+            bundle.add_file(path, value)
+        else:
+            bundle.add_bytes(path, value)
+
+def warm_up():
+    # Loads what the first request would otherwise import and initialize:
+    # every parser backend, Pillow's format plugins, the page HTTP client and the
+    # default catalog. Run in a preloading gunicorn master, forked workers
+    # share all of it copy-on-write.
+    started = time.perf_counter()
+    from bs4 import BeautifulSoup
+
+    for backend in PARSER_BACKENDS:
+        try:
+            BeautifulSoup("<p></p>", backend)
+        except Exception as e:
+            logger.warning("Parser '%s' is not available: %s", backend, e)
+    builder_tags()
+    header_markup([], None, None)
+    from PIL import Image
+
+    Image.init()
+    logger.debug("Logo formats: %s", logo_store.formats)
+    http_session.load()
     try:
-        shutil.rmtree(output_dir)
-        print("Temporary output directory removed")
-    except Exception as e:
-        print(f"Failed to clean up temporary directory: {str(e)}")
-        raise
+        catalog_store.get()
+    except CatalogError as e:
+        logger.warning("Default catalog not loaded: %s", e)
+    logger.info("Warm-up took %.0f ms", (time.perf_counter() - started) * 1000)
 
-    return zip_filename
 
 def main():
     try:
@@ -398,29 +1182,31 @@ def main():
             print("Skipping logo selection.")
             logo_filename = None
 
-        replacements = read_json(json_path)
-        if not replacements:
-            print("Failed to read JSON.")
+        try:
+            catalog = load_catalog(json_path)
+        except (OSError, CatalogError) as e:
+            print(f"Failed to read JSON: {e}")
             return
 
-        selected_keys = ask_user_sections(replacements)
+        selected_keys = ask_user_sections(catalog.sections)
 
         output_folder = "generated"
         os.makedirs(output_folder, exist_ok=True)
 
         zip_filename = process_website(
             url,
-            json_path,
+            catalog,
             image_folder,
             [logo_filename] if logo_filename else [],
             selected_keys,
             output_folder
         )
 
-        print(f"\nWebsite processed and saved as a zip file: {os.path.join(output_folder, zip_filename)}")
+        print(f"\nWebsite processed and saved as a zip file: {shard_path(output_folder, zip_filename)}")
 
     except Exception as e:
         print(f"Unexpected error: {e}")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(message)s")
     main()
\ No newline at end of file
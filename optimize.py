@@ -0,0 +1,152 @@
+import gzip
+import logging
+import os
+import re
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Entries that get .gz/.br siblings; everything else is already compressed
+# or too small to matter
+PRECOMPRESS_EXTENSIONS = {".html", ".css", ".js", ".svg", ".json", ".txt", ".xml"}
+HTML_EXTENSIONS = {".html", ".htm"}
+# Static hosts skip precompressed files that are not smaller than this
+MIN_PRECOMPRESS_BYTES = 256
+
+# Content of these elements is kept byte for byte
+RAW_ELEMENT = re.compile(r"(<(pre|textarea|script|style)\b(?:\"[^\"]*\"|'[^']*'|[^'\">])*>)(.*?)(</\2\s*>)", re.IGNORECASE | re.DOTALL)
+TOKEN = re.compile(r"<!--.*?-->|<[A-Za-z](?:\"[^\"]*\"|'[^']*'|[^'\">])*>|[^<]+|<", re.DOTALL)
+ATTRIBUTE = re.compile(r"""\s+([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+# Characters an unquoted attribute value may not contain
+NEEDS_QUOTES = re.compile(r"[\s\"'=<>`]")
+WHITESPACE = re.compile(r"[ \t\n\r\f]+")
+# The trailing slash on these means nothing in HTML; on SVG/MathML it does
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def minify_tag(tag):
+    # Drops quotes around values that do not need them; anything the
+    # attribute pattern does not fully account for is left alone
+    name = re.match(r"<([A-Za-z][^\s/>]*)", tag)
+    end = "/>" if tag.endswith("/>") else ">"
+    body = tag[name.end():len(tag) - len(end)]
+    parts = [name.group(0)]
+    consumed = 0
+    unquoted_last = False
+    for match in ATTRIBUTE.finditer(body):
+        if match.start() != consumed:
+            return tag
+        consumed = match.end()
+        attr = match.group(1)
+        value = next((v for v in match.group(2, 3, 4) if v is not None), None)
+        unquoted_last = False
+        if value is None or value == "":
+            parts.append(f" {attr}")
+        elif NEEDS_QUOTES.search(value):
+            quote = "'" if '"' in value else '"'
+            parts.append(f" {attr}={quote}{value}{quote}")
+        else:
+            parts.append(f" {attr}={value}")
+            unquoted_last = True
+    if body[consumed:].strip():
+        return tag
+    if end == "/>" and name.group(1).lower() in VOID_ELEMENTS:
+        end = ">"
+    elif end == "/>" and unquoted_last:
+        # <path d=x/> would read the slash as part of the value
+        end = " />"
+    return "".join(parts) + end
+
+
+def minify_text(html):
+    out = []
+    for token in TOKEN.findall(html):
+        if token.startswith("<!--"):
+            # Conditional comments still mean something to old IE
+            if token.startswith("<!--[if") or token.startswith("<!--<!"):
+                out.append(token)
+        elif token.startswith("<") and len(token) > 1:
+            out.append(minify_tag(token))
+        else:
+            text = WHITESPACE.sub(" ", token)
+            if text.startswith(" ") and out and out[-1].endswith(" "):
+                # The whitespace around a removed comment
+                text = text[1:]
+            out.append(text)
+    return "".join(out)
+
+
+def minify_html(html):
+    # Collapses whitespace runs to one space (browsers render them the same),
+    # strips comments and redundant attribute quotes. <pre>, <textarea>,
+    # <script> and <style> content is copied unchanged.
+    out = []
+    position = 0
+    for match in RAW_ELEMENT.finditer(html):
+        out.append(minify_text(html[position:match.start()]))
+        out.append(minify_tag(match.group(1)))
+        out.append(match.group(3))
+        out.append(match.group(4))
+        position = match.end()
+    out.append(minify_text(html[position:]))
+    return "".join(out).strip()
+
+
+def gzip_bytes(data):
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def brotli_bytes(data):
+    return brotli.compress(data, quality=11)
+
+
+class OutputOptimizer:
+    # Minifies HTML entries as they are added to a bundle and adds .gz/.br
+    # siblings for text entries; report lists the bytes saved per file
+    def __init__(self, minify=True, precompress=True):
+        self.minify = minify
+        self.precompress = precompress
+        self.report = []
+        if precompress and brotli is None:
+            logger.warning("Brotli is not installed; bundles get .gz files only")
+
+    def handles(self, arcname):
+        extension = os.path.splitext(arcname)[1].lower()
+        return (self.minify and extension in HTML_EXTENSIONS) or (self.precompress and extension in PRECOMPRESS_EXTENSIONS)
+
+    def process(self, arcname, data):
+        # Returns the (arcname, data) entries to write in place of the original
+        extension = os.path.splitext(arcname)[1].lower()
+        entry = {"file": arcname, "original": len(data)}
+        if self.minify and extension in HTML_EXTENSIONS:
+            data = minify_html(data.decode("utf-8")).encode("utf-8")
+            entry["minified"] = len(data)
+        entries = [(arcname, data)]
+        if self.precompress and extension in PRECOMPRESS_EXTENSIONS and len(data) >= MIN_PRECOMPRESS_BYTES:
+            compressors = [("gz", gzip_bytes)] + ([("br", brotli_bytes)] if brotli is not None else [])
+            for suffix, compress in compressors:
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    entries.append((f"{arcname}.{suffix}", compressed))
+                    entry[suffix] = len(compressed)
+        entry["saved"] = entry["original"] - len(data)
+        if len(entries) > 1 or entry["saved"]:
+            metrics.optimized_bytes_saved.inc(entry["saved"])
+            self.report.append(entry)
+            logger.debug("Optimized %s: %s", arcname, entry)
+        return entries
+
+    def describe(self):
+        # One "name original -> minified (gz n, br n)" item per file
+        items = []
+        for entry in self.report:
+            sizes = ", ".join(f"{suffix} {entry[suffix]}" for suffix in ("gz", "br") if suffix in entry)
+            items.append(f"{entry['file']} {entry['original']} -> {entry['original'] - entry['saved']}" + (f" ({sizes})" if sizes else ""))
+        return "; ".join(items)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    # Rendered pages by content key: a bounded in-memory LRU in front of a
+    # directory shared by every worker process, itself kept under max_bytes.
+    def __init__(self, root="cache/sections", max_entries=256, max_bytes=50 * 1024 * 1024):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def get(self, key, render):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                metrics.cache_requests.inc(cache="section", result="memory_hit")
+                return data
+
+        path = os.path.join(self.root, key[:2], f"{key}.html")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            self._touch(path)
+            metrics.cache_requests.inc(cache="section", result="disk_hit")
+        except OSError:
+            metrics.cache_requests.inc(cache="section", result="miss")
+            data = render().encode("utf-8")
+            self._write(path, data)
+
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return data
+
+    def _write(self, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError as e:
+            logger.warning("Failed to cache page: %s", e)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Least recently used pages go first; disk hits bump the mtime
+        with self._evict_lock:
+            entries = []
+            total = 0
+            for directory, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if not name.endswith(".html"):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
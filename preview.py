@@ -0,0 +1,68 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+
+class PageSkeleton:
+    # A rewritten page serialized around named slots. The slots start out as
+    # marker comments in the tree; fill() puts markup in their place.
+    def __init__(self, text, slots):
+        pattern = re.compile("|".join(re.escape(f"<!--{marker}-->") for marker in slots.values()))
+        names = {f"<!--{marker}-->": name for name, marker in slots.items()}
+        self.segments = []
+        position = 0
+        for match in pattern.finditer(text):
+            self.segments.append(text[position:match.start()])
+            self.segments.append((names[match.group(0)],))
+            position = match.end()
+        self.segments.append(text[position:])
+        self.size = len(text)
+
+    @staticmethod
+    def markers(*names):
+        # Comments to put in the tree, unique so page content cannot match them
+        token = uuid.uuid4().hex
+        return {name: f"slot-{name}-{token}" for name in names}
+
+    def fill(self, **slots):
+        return "".join(slots[segment[0]] if isinstance(segment, tuple) else segment for segment in self.segments)
+
+
+class PreviewCache:
+    # Short-lived in-memory LRU for preview state; entries expire ttl
+    # seconds after they were stored, and only this process sees them.
+    def __init__(self, name, max_entries=16, ttl=600):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                metrics.cache_requests.inc(cache=self.name, result="hit")
+                return entry[1]
+            self._entries.pop(key, None)
+        metrics.cache_requests.inc(cache=self.name, result="miss")
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def get_or_build(self, key, build):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, build())
+        return value
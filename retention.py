@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Build leftovers: BundleWriter's hidden .part files and cache .tmp files
+TEMP_SUFFIXES = (".part", ".tmp")
+HEX_PREFIX = re.compile(r"^[0-9a-f]{2}")
+SHARD_NAME = re.compile(r"^[0-9a-f]{2}$")
+# Only files the app names itself are swept: uploaded logos, batch manifests
+# and results, bundles, and the temporary files they are written through.
+# Anything else an operator keeps in these folders is left alone.
+UUID = r"[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}"
+APP_FILE = re.compile(rf"^(?:logo_{UUID}(?:\.[^.]*)?|batch_{UUID}(?:\.[^.]+)*|website_[0-9a-f]{{32}}\.zip)$")
+APP_TEMP_FILE = re.compile(rf"^\.?(?:logo_{UUID}|batch_{UUID}|website_[0-9a-f]{{32}})\..*\.(?:part|tmp)$")
+
+
+def shard_for(filename):
+    # Generated names look like website_<hash>.zip or logo_<uuid>.png, so the
+    # shard is the first two hex characters after the prefix and can be read
+    # off the name; anything else is sharded by a hash of the name
+    _, separator, rest = filename.partition("_")
+    match = HEX_PREFIX.match(rest.lower()) if separator else None
+    if match:
+        return match.group(0)
+    return hashlib.sha256(filename.encode("utf-8")).hexdigest()[:2]
+
+
+def shard_path(root, filename):
+    return os.path.join(root, shard_for(filename), filename)
+
+
+def locate(root, filename):
+    # Files written before sharding stay readable at the top level
+    path = shard_path(root, filename)
+    legacy = os.path.join(root, filename)
+    if not os.path.exists(path) and os.path.isfile(legacy):
+        return legacy
+    return path
+
+
+def touch(path):
+    # Reads are recorded in the access time, which is what eviction orders
+    # by; mtime keeps the creation time
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+class Retention:
+    # Keeps a set of folders under a byte quota and a maximum age. Files
+    # used within the grace period are never deleted, so a sweep cannot
+    # pull a logo or bundle out from under a running job. on_remove(path)
+    # runs after each deletion, for records that live as long as the file.
+    def __init__(self, roots, max_bytes=2 * 1024 * 1024 * 1024, max_age=3 * 86400, interval=600, grace=3600, on_remove=None):
+        self.roots = list(roots)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.grace = grace
+        self.on_remove = on_remove
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Retention sweep failed")
+            self._stop.wait(self.interval)
+
+    def sweep(self):
+        with self._lock:
+            now = time.time()
+            removed = {"expired": 0, "quota": 0, "orphan": 0}
+            freed = 0
+            entries = []
+            total = 0
+            for path, stat in self._scan():
+                if path.endswith(TEMP_SUFFIXES):
+                    # A failed build or a killed worker left this behind
+                    if now - stat.st_mtime > self.grace and self._remove(path):
+                        removed["orphan"] += 1
+                        freed += stat.st_size
+                    continue
+                last_used = max(stat.st_atime, stat.st_mtime)
+                if self.max_age and now - last_used > self.max_age:
+                    if self._remove(path):
+                        removed["expired"] += 1
+                        freed += stat.st_size
+                    continue
+                entries.append((last_used, stat.st_size, path))
+                total += stat.st_size
+
+            # Least recently used first
+            entries.sort()
+            for last_used, size, path in entries:
+                if total <= self.max_bytes or now - last_used < self.grace:
+                    break
+                if self._remove(path):
+                    removed["quota"] += 1
+                    freed += size
+                    total -= size
+
+            for reason, count in removed.items():
+                if count:
+                    metrics.retention_files.inc(count, reason=reason)
+            metrics.retention_bytes.inc(freed)
+            if any(removed.values()):
+                logger.info("Retention removed %d expired, %d over quota and %d orphaned files (%d bytes), %d bytes kept",
+                            removed["expired"], removed["quota"], removed["orphan"], freed, total)
+            return {"removed": removed, "freed_bytes": freed, "kept_bytes": total}
+
+    def _scan(self):
+        # The top level (files from before sharding) and the shard folders
+        for root in self.roots:
+            directories = [root]
+            try:
+                directories += [entry.path for entry in os.scandir(root) if entry.is_dir() and SHARD_NAME.match(entry.name)]
+            except OSError:
+                continue
+            for directory in directories:
+                try:
+                    entries = [entry for entry in os.scandir(directory) if entry.is_file(follow_symlinks=False)]
+                except OSError:
+                    continue
+                for entry in entries:
+                    if not (APP_FILE.match(entry.name) or APP_TEMP_FILE.match(entry.name)):
+                        continue
+                    try:
+                        yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.debug("Could not remove %s: %s", path, e)
+            return False
+        if self.on_remove is not None:
+            try:
+                self.on_remove(path)
+            except Exception:
+                logger.exception("Cleanup after removing %s failed", path)
+        return True
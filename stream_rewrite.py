@@ -0,0 +1,366 @@
+import codecs
+import functools
+import re
+import tempfile
+from array import array
+from html.parser import HTMLParser
+
+HEADING_TAGS = {"h1", "h2", "h3"}
+LOGO_RANKS = 5
+MARKED_SECTION_NAME = re.compile(r"[a-zA-Z][-_.a-zA-Z0-9]*")
+CHUNK_CHARS = 64 * 1024
+# Rewritten markup is handed to the writer in pieces of about this size
+FLUSH_CHARS = 64 * 1024
+
+
+class StreamingUnsupported(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def builder_tags():
+    # What bs4's html.parser builder treats as having no contents, and the
+    # tags whose strings bs4 gives their own types, which get_text() skips.
+    # Read on first use, so importing this module does not import bs4.
+    from bs4.builder import HTMLTreeBuilder
+
+    return frozenset(HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS), frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+
+
+def start_tag_markup(tag, attrs, self_closing=False):
+    from bs4.dammit import EntitySubstitution
+
+    parts = [f"<{tag}"]
+    for name, value in attrs.items():
+        if value is None:
+            parts.append(f" {name}")
+        else:
+            parts.append(f" {name}={EntitySubstitution.substitute_xml(value, make_quoted_attribute=True)}")
+    parts.append("/>" if self_closing else ">")
+    return "".join(parts)
+
+
+class SpooledPage:
+    # The source page as UTF-8 in an unnamed temporary file. Each pass reads
+    # it back in chunks, so the text does not have to stay in memory.
+    def __init__(self, text):
+        self.size = len(text)
+        self._file = tempfile.TemporaryFile()
+        for start in range(0, len(text), CHUNK_CHARS):
+            self._file.write(text[start:start + CHUNK_CHARS].encode("utf-8", "surrogatepass"))
+
+    def chunks(self):
+        self._file.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+        for data in iter(lambda: self._file.read(CHUNK_CHARS), b""):
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+    def read(self):
+        return "".join(self.chunks())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class PageTokenizer(HTMLParser):
+    # Splits a page into the elements bs4's html.parser builder would build:
+    # void and self-closed tags are empty, an end tag closes everything
+    # opened after its start tag and stray end tags close nothing. Start
+    # tags are numbered in document order, the same way in every pass.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.void_elements, self.string_containers = builder_tags()
+        self.position = 0
+        self._open = []
+        self._open_names = {}
+        self._text = []
+        self._text_raw = False
+
+    def run(self, chunks):
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+            self.close()
+        except AssertionError as e:
+            # html.parser gives up on some malformed declarations
+            raise StreamingUnsupported(f"Tokenizer rejected the page: {e}") from e
+        self._flush_text()
+        while self._open:
+            self._pop(False)
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, tag in self.void_elements)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def _start(self, tag, attrs, empty):
+        self._flush_text()
+        self.position += 1
+        # Later duplicates win, as in bs4
+        self.start_tag(tag, dict(attrs), self.position, empty)
+        if not empty:
+            self._open.append((tag, self.position))
+            self._open_names[tag] = self._open_names.get(tag, 0) + 1
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if not self._open_names.get(tag):
+            self.stray_end_tag(tag)
+            return
+        while self._open[-1][0] != tag:
+            self._pop(False)
+        self._pop(True)
+
+    def _pop(self, explicit):
+        tag, position = self._open.pop()
+        self._open_names[tag] -= 1
+        self.closed(tag, position, explicit)
+
+    def handle_data(self, data):
+        # Script and style content arrives unescaped and is copied as is
+        self._text_raw = self.cdata_elem is not None and not getattr(self, "_escapable", False)
+        self._text.append(data)
+
+    def _flush_text(self):
+        # Adjacent data is one string to bs4, which matters for strip()
+        if self._text:
+            data = "".join(self._text)
+            self._text = []
+            self.text(data, self._text_raw)
+
+    def handle_comment(self, data):
+        self._flush_text()
+        self.markup(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self._flush_text()
+        self.markup(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        self._flush_text()
+        self.markup(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> and friends; conditional sections end in ]>
+        self._flush_text()
+        name = MARKED_SECTION_NAME.match(data)
+        end = "]>" if name and name.group(0).lower() in ("if", "else", "endif") else "]]>"
+        self.markup(f"<![{data}{end}")
+
+    def start_tag(self, tag, attrs, position, empty):
+        pass
+
+    def closed(self, tag, position, explicit):
+        pass
+
+    def stray_end_tag(self, tag):
+        pass
+
+    def text(self, data, raw):
+        pass
+
+    def markup(self, text):
+        pass
+
+
+class PageScanner(PageTokenizer):
+    # First pass: works out which tags the nav, logo and heading rules would
+    # pick, keeping only tag numbers and the last few characters of text.
+    # logo_rank(tag, attrs) ranks <img>/<svg> logo candidates, lowest first.
+    def __init__(self, nav_tags, nav_keywords, logo_rank=None):
+        super().__init__()
+        self.nav_tags = frozenset(nav_tags)
+        self.nav_keywords = list(nav_keywords)
+        self.logo_rank = logo_rank
+        self.logos = [array("q") for _ in range(LOGO_RANKS)]
+        self.headings = array("q")
+        self.bodies = array("q")
+        self.nav = None
+        self._nav_start = None
+        # The outermost open nav tag and where its text starts; tags inside
+        # it can only match if it does, and it comes first
+        self._candidate = None
+        self._containers = 0
+        self._window = max(len(keyword) for keyword in self.nav_keywords) - 1
+        self._tail = ""
+        self._length = 0
+
+    def start_tag(self, tag, attrs, position, empty):
+        if tag in self.nav_tags and not empty and self._candidate is None and self._nav_start is None:
+            self._candidate = (position, self._length)
+        if tag in self.string_containers and not empty:
+            self._containers += 1
+        if tag == "body":
+            self.bodies.append(position)
+        elif tag in HEADING_TAGS:
+            self.headings.append(position)
+        elif self.logo_rank is not None and tag in ("img", "svg"):
+            self.logos[self.logo_rank(tag, attrs)].append(position)
+
+    def closed(self, tag, position, explicit):
+        if tag in self.string_containers:
+            self._containers -= 1
+        if self._candidate is not None and position == self._candidate[0]:
+            self._candidate = None
+        if position == self._nav_start:
+            self.nav = (position, self.position)
+
+    def text(self, data, raw):
+        if self._containers:
+            return
+        stripped = data.strip()
+        if not stripped:
+            return
+        lowered = stripped.lower()
+        if self._candidate is not None and self._nav_start is None:
+            # Keywords may straddle strings, as they do in the joined text
+            window = self._tail + lowered
+            begin = max(0, self._candidate[1] - (self._length - len(self._tail)))
+            if any(window.find(keyword, begin) != -1 for keyword in self.nav_keywords):
+                self._nav_start = self._candidate[0]
+        self._length += len(lowered)
+        self._tail = (self._tail + lowered)[-self._window:] if self._window else ""
+
+    def plan(self):
+        # Everything the nav container holds is dropped, so nothing in it
+        # can be the logo, the heading or the body
+        nav = self.nav
+
+        def first(positions):
+            return next((p for p in positions if not (nav and nav[0] < p <= nav[1])), None)
+
+        plan = {"nav": nav, "logo": None, "heading": None, "body": None, "logo_in_body": False}
+        if nav is None:
+            if not self.bodies:
+                raise StreamingUnsupported("Page has no <body> for the navigation links")
+            plan["body"] = self.bodies[0]
+        if self.logo_rank is not None:
+            for positions in self.logos:
+                plan["logo"] = first(positions)
+                if plan["logo"] is not None:
+                    break
+            else:
+                plan["heading"] = first(self.headings)
+                if plan["heading"] is None:
+                    body = first(self.bodies)
+                    if body is None or (plan["body"] is not None and body != plan["body"]):
+                        raise StreamingUnsupported("Page has no <body> for the logo")
+                    plan["body"] = body
+                    plan["logo_in_body"] = True
+        return plan
+
+
+class PageRewriter(PageTokenizer):
+    # Second pass: copies the page to write() token by token, swapping in
+    # the nav links and logo where the plan says and pointing links and
+    # forms at the placeholder pages. Untouched markup is copied verbatim.
+    def __init__(self, plan, nav_html, logo_html, write, construction_page="construction.html", submit_page="submit.html"):
+        from bs4.dammit import EntitySubstitution
+
+        super().__init__()
+        self.escape = EntitySubstitution.substitute_xml
+        self.plan = plan
+        self.nav_html = nav_html
+        self.logo_html = logo_html
+        self.write = write
+        self.construction_page = construction_page
+        self.submit_page = submit_page
+        self._skip = None
+        self._pieces = []
+        self._size = 0
+
+    def run(self, chunks):
+        super().run(chunks)
+        self._flush()
+
+    def _emit(self, text):
+        self._pieces.append(text)
+        self._size += len(text)
+        if self._size >= FLUSH_CHARS:
+            self._flush()
+
+    def _flush(self):
+        if self._pieces:
+            self.write("".join(self._pieces))
+            self._pieces = []
+            self._size = 0
+
+    def rewrite_attributes(self, tag, attrs):
+        if tag == "a" and "href" in attrs:
+            attrs["href"] = self.construction_page
+            attrs.pop("target", None)
+        elif tag == "form":
+            attrs["action"] = self.submit_page
+        elif tag == "input" and (attrs.get("type") or "").lower() == "submit":
+            attrs["formaction"] = self.submit_page
+        elif tag == "button" and (attrs.get("type") or "").lower() == "submit":
+            attrs["onclick"] = f"location.href='{self.submit_page}'; return false;"
+        else:
+            return False
+        return True
+
+    def start_tag(self, tag, attrs, position, empty):
+        if self._skip is not None:
+            return
+        plan = self.plan
+        if position == plan["logo"]:
+            self._emit(self.logo_html)
+            if not empty:
+                self._skip = (position, False)
+            return
+        if position == plan["heading"]:
+            self._emit(self.logo_html)
+
+        inserted = None
+        is_nav = plan["nav"] is not None and position == plan["nav"][0]
+        if is_nav:
+            inserted = self.nav_html
+        elif position == plan["body"]:
+            # The logo goes in at the top of the body, ahead of the new nav
+            inserted = (self.logo_html if plan["logo_in_body"] else "") + (f"<div>{self.nav_html}</div>" if plan["nav"] is None else "")
+
+        if self.rewrite_attributes(tag, attrs) or (inserted is not None and empty):
+            self._emit(start_tag_markup(tag, attrs, empty and inserted is None and self.get_starttag_text().endswith("/>")))
+        else:
+            self._emit(self.get_starttag_text())
+        if inserted is not None:
+            self._emit(inserted)
+            if empty:
+                self._emit(f"</{tag}>")
+            elif is_nav:
+                self._skip = (position, True)
+
+    def closed(self, tag, position, explicit):
+        if self._skip is not None:
+            if position == self._skip[0]:
+                if self._skip[1]:
+                    self._emit(f"</{tag}>")
+                self._skip = None
+            return
+        if explicit:
+            self._emit(f"</{tag}>")
+
+    def stray_end_tag(self, tag):
+        if self._skip is None:
+            self._emit(f"</{tag}>")
+
+    def text(self, data, raw):
+        if self._skip is None:
+            self._emit(data if raw else self.escape(data))
+
+    def markup(self, text):
+        if self._skip is None:
+            self._emit(text)
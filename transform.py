@@ -0,0 +1,142 @@
+import contextlib
+import heapq
+from bisect import bisect_left
+
+
+class DocumentIndex:
+    # One pass over the tree records, in document order, every tag the rules
+    # asked for, plus each text tag's slice of the page's stripped, lowercased
+    # text. Rules then look tags up here instead of re-walking the soup.
+    def __init__(self, soup, tag_names=(), text_tag_names=()):
+        self.soup = soup
+        self.tags = {name: [] for name in tag_names}
+        self.text = ""
+        self._positions = {}
+        self._spans = {}
+        self._detached = set()
+        self._occurrences = {}
+        self._walk(set(text_tag_names))
+        self._next_position = self._last_position + 1
+
+    def _walk(self, text_tag_names):
+        # bs4 is already loaded by whoever parsed the soup
+        from bs4 import CData, NavigableString, Tag
+
+        # get_text() only looks at these string types for ordinary tags
+        text_string_types = {NavigableString, CData}
+        tags = self.tags
+        positions = self._positions
+        spans = self._spans
+        parts = []
+        length = 0
+        counter = 0
+        stack = [(self.soup, iter(self.soup.contents))]
+        while stack:
+            parent, children = stack[-1]
+            node = next(children, None)
+            if node is None:
+                stack.pop()
+                key = id(parent)
+                if key in positions:
+                    positions[key] = (positions[key][0], counter)
+                if key in spans:
+                    spans[key] = (spans[key][0], length)
+                continue
+            if isinstance(node, Tag):
+                counter += 1
+                if node.name in tags:
+                    tags[node.name].append(node)
+                    positions[id(node)] = (counter, counter)
+                if node.name in text_tag_names:
+                    spans[id(node)] = (length, length)
+                if node.contents:
+                    stack.append((node, iter(node.contents)))
+            elif type(node) in text_string_types:
+                stripped = node.strip()
+                if stripped:
+                    lowered = stripped.lower()
+                    parts.append(lowered)
+                    length += len(lowered)
+        self.text = "".join(parts)
+        self._last_position = counter
+
+    def find_all(self, names):
+        if isinstance(names, str):
+            names = [names]
+        lists = [self.tags.get(name, []) for name in names]
+        merged = lists[0] if len(lists) == 1 else heapq.merge(*lists, key=lambda tag: self._positions[id(tag)][0])
+        return [tag for tag in merged if id(tag) not in self._detached]
+
+    def find(self, names):
+        found = self.find_all(names)
+        return found[0] if found else None
+
+    def text_contains_any(self, tag, keywords):
+        # Same answer as `any(k in tag.get_text(strip=True).lower() ...)`
+        # without re-walking the subtree
+        start, end = self._spans[id(tag)]
+        for keyword in keywords:
+            occurrences = self._occurrences.get(keyword)
+            if occurrences is None:
+                occurrences = self._occurrences[keyword] = self._find_occurrences(keyword)
+            i = bisect_left(occurrences, start)
+            if i < len(occurrences) and occurrences[i] + len(keyword) <= end:
+                return True
+        return False
+
+    def _find_occurrences(self, keyword):
+        occurrences = []
+        pos = self.text.find(keyword)
+        while pos != -1:
+            occurrences.append(pos)
+            pos = self.text.find(keyword, pos + 1)
+        return occurrences
+
+    def detach(self, tag, include_self=True):
+        # Forget indexed tags that are no longer part of the output tree
+        start, end = self._positions[id(tag)]
+        for key, (enter, _) in self._positions.items():
+            if start < enter <= end:
+                self._detached.add(key)
+        if include_self:
+            self._detached.add(id(tag))
+
+    def adopt(self, tag):
+        # Index a tag that a rule created so later rules still see it
+        if tag.name in self.tags:
+            self.tags[tag.name].append(tag)
+            self._positions[id(tag)] = (self._next_position, self._next_position)
+            self._next_position += 1
+
+
+class TransformRule:
+    def __init__(self, apply, tag_names, text_tag_names=(), name=None):
+        self.apply = apply
+        self.tag_names = list(tag_names)
+        self.text_tag_names = list(text_tag_names)
+        self.name = name or getattr(apply, "__name__", "rule")
+
+
+class TransformPipeline:
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        return self
+
+    def run(self, soup, span=None):
+        # span, if given, is a context manager factory called with "index"
+        # and each rule's name so callers can time the individual steps
+        span = span or (lambda name: contextlib.nullcontext())
+        tag_names = []
+        text_tag_names = []
+        for rule in self.rules:
+            tag_names.extend(name for name in rule.tag_names if name not in tag_names)
+            text_tag_names.extend(name for name in rule.text_tag_names if name not in text_tag_names)
+        with span("index"):
+            index = DocumentIndex(soup, tag_names, text_tag_names)
+        for rule in self.rules:
+            with span(rule.name):
+                rule.apply(soup, index)
+        return soup